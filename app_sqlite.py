@@ -1,12 +1,35 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS
 import sqlite3
+import io
+import itertools
 import json
+from urllib.parse import urlencode
 import os
+import threading
+import dataset
+import reverse_geocode
+from geometry import boundary_distance
+from spatial_index import RegionBallTree
+from geometry_pack import GeometryPack
+from config import SINGLEFLIGHT_DIR, WRITE_QUEUE
+from singleflight import SingleFlight
+from write_queue import GroupCommitWriter
 
 app = Flask(__name__)
 CORS(app)
 
+# Memory-mapped geometry pack (see export_geometry_pack.py)
+geometry_pack = GeometryPack()
+
+# Coalesces concurrent identical requests to the expensive list endpoints
+coalescer = SingleFlight(SINGLEFLIGHT_DIR)
+
+# Optional group-commit writer for create/update (WRITE_QUEUE in config.py)
+write_queue = GroupCommitWriter(
+    lambda: get_db(), WRITE_QUEUE['max_batch'], WRITE_QUEUE['max_delay_ms'], WRITE_QUEUE['submit_timeout_s']
+) if WRITE_QUEUE['enabled'] else None
+
 # Database configuration
 DATABASE = 'database/globe.db'
 
@@ -22,6 +45,9 @@ def init_db():
     db = get_db()
     cursor = db.cursor()
 
+    # WAL lets readers keep serving the previous rows while an import swaps in new ones
+    cursor.execute('PRAGMA journal_mode=WAL')
+
     # Create regions table (supports countries and sub-regions)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS regions (
@@ -38,6 +64,9 @@ def init_db():
         )
     ''')
 
+    db.commit()
+    dataset.ensure_schema(db)
+    dataset.refresh_geometry_columns(db)
     db.commit()
     db.close()
     print("Database initialized successfully!")
@@ -47,9 +76,38 @@ def index():
     """Render the main SPA page"""
     return render_template('index.html')
 
+def coalesced_json(db, compute):
+    """
+    Serialize compute() to a JSON response, sharing one computation between all
+    concurrent requests for the same URL at the same dataset version
+    """
+    key = '{}:{}?{}'.format(
+        dataset.get_version(db), request.path, urlencode(sorted(request.args.items(multi=True)))
+    )
+    body = coalescer.do(key, lambda: app.json.dumps(compute()).encode('utf-8'))
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/metrics/singleflight', methods=['GET'])
+def get_singleflight_metrics():
+    """Request coalescing counters for this worker process"""
+    return jsonify(coalescer.stats())
+
+@app.route('/api/dataset/version', methods=['GET'])
+def get_dataset_version():
+    """Current dataset versions, for client-side caches keyed by them"""
+    db = get_db()
+    versions = {
+        'version': dataset.get_version(db),
+        'geometry_version': dataset.get_version(db, 'geometry_version')
+    }
+    db.close()
+    response = jsonify(versions)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/regions', methods=['GET'])
 def get_regions():
-    """Get all regions or filter by type/parent"""
+    """Get all regions or filter by type/parent/custom_data attributes"""
     region_type = request.args.get('type', None)
     parent_id = request.args.get('parent_id', None)
 
@@ -67,39 +125,364 @@ def get_regions():
         query += ' AND parent_id = ?'
         params.append(parent_id)
 
-    cursor.execute(query, params)
-    regions = cursor.fetchall()
+    # custom.<key>=value filters; repeat a key to match any of several values
+    for arg in request.args:
+        if not arg.startswith('custom.'):
+            continue
+        try:
+            expression = dataset.custom_key_expression(db, arg[len('custom.'):])
+        except ValueError as e:
+            db.close()
+            return jsonify({'error': str(e)}), 400
+        values = request.args.getlist(arg)
+        query += f' AND {expression} IN ({", ".join(["?"] * len(values))})'
+        params.extend(values)
+
+    # Range filters and sorting over the precomputed geometry statistics
+    try:
+        for name in dataset.GEOMETRY_COLUMNS:
+            for prefix, op in (('min_', '>='), ('max_', '<=')):
+                value = request.args.get(prefix + name)
+                if value is not None:
+                    query += f' AND {name} {op} ?'
+                    params.append(float(value))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        db.close()
+        return jsonify({'error': 'Filter values and limit must be numbers'}), 400
+
+    sort = request.args.get('sort')
+    if sort:
+        if sort not in dataset.GEOMETRY_COLUMNS and sort not in ('id', 'name', 'code'):
+            db.close()
+            return jsonify({'error': f'Cannot sort by {sort}'}), 400
+        order = 'DESC' if request.args.get('order', 'asc').lower() == 'desc' else 'ASC'
+        query += f' ORDER BY {sort} {order}'
+    if limit is not None:
+        query += f' LIMIT {max(0, limit)}'
+
+    def load():
+        cursor.execute(query, params)
+        regions = cursor.fetchall()
+        return [dict(row) for row in regions]
+
+    response = coalesced_json(db, load)
     db.close()
+    return response
+
+@app.route('/api/regions/attributes', methods=['GET'])
+def get_regions_attributes():
+    """Attributes of every region with geometry, without the geometry, for clients that cache geometry"""
+    db = get_db()
+    cursor = db.cursor()
 
-    return jsonify([dict(row) for row in regions])
+    def load():
+        cursor.execute('''
+            SELECT id, name, code, region_type, owner, custom_data
+            FROM regions WHERE geojson_data IS NOT NULL ORDER BY id
+        ''')
+        return [dict(row) for row in cursor.fetchall()]
+
+    response = coalesced_json(db, load)
+    db.close()
+    return response
 
 @app.route('/api/regions/geojson', methods=['GET'])
 def get_regions_geojson():
     db = get_db()
     cursor = db.cursor()
-    cursor.execute('SELECT geojson_data, owner, code, parent_id FROM regions WHERE geojson_data IS NOT NULL')
+
+    def load():
+        cursor.execute('SELECT geojson_data, owner, code, parent_id FROM regions WHERE geojson_data IS NOT NULL')
+        rows = cursor.fetchall()
+
+        features = []
+        for row in rows:
+            geojson = json.loads(row['geojson_data'])
+            # Add or override properties to carry needed info (code, owner, parent_id)
+            if 'properties' not in geojson:
+                geojson['properties'] = {}
+            geojson['properties'].update({
+                'owner': row['owner'],
+                'code': row['code'],
+                'parent_id': row['parent_id']
+            })
+            features.append(geojson)
+
+        return {
+            "type": "FeatureCollection",
+            "features": features
+        }
+
+    response = coalesced_json(db, load)
+    db.close()
+    return response
+
+# Current name, code, region_type and owner of every region (a scan of a few columns,
+# no geometry), re-read when the dataset version changes
+_attributes_index = {'version': None, 'regions': {}}
+_attributes_lock = threading.Lock()
+
+def get_region_attributes(db):
+    """Return {id: region dict} with each region's current attributes"""
+    version = dataset.get_version(db)
+    with _attributes_lock:
+        if _attributes_index['version'] != version:
+            cursor = db.cursor()
+            cursor.execute('SELECT id, name, code, region_type, owner FROM regions')
+            _attributes_index['regions'] = {row['id']: dict(row) for row in cursor.fetchall()}
+            _attributes_index['version'] = version
+        return _attributes_index['regions']
+
+# Nearest-region ball tree over every region, and its cache of parsed geometries
+# for boundary distances. Both only depend on geometry, so they are rebuilt when
+# geometry_version changes, not on attribute-only writes
+_nearest_index = {'geometry_version': None, 'tree': None}
+_nearest_lock = threading.Lock()
+
+def get_nearest_tree(db):
+    """Return the ball tree, rebuilding it if some geometry changed"""
+    geometry_version = dataset.get_version(db, 'geometry_version')
+    with _nearest_lock:
+        if _nearest_index['geometry_version'] != geometry_version:
+            cursor = db.cursor()
+            cursor.execute('''
+                SELECT id, name, code, region_type, owner, centroid_lon, centroid_lat, radius_km
+                FROM regions WHERE centroid_lat IS NOT NULL
+            ''')
+            _nearest_index['tree'] = RegionBallTree([dict(row) for row in cursor.fetchall()])
+            _nearest_index['geometry_version'] = geometry_version
+        return _nearest_index['tree']
+
+@app.route('/api/regions/search', methods=['GET'])
+def search_regions():
+    """Autocomplete regions by name or code prefix"""
+    text = request.args.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    db = get_db()
+    terms = dataset.search_terms(db, text)
+    if not terms:
+        db.close()
+        return jsonify([])
+
+    # Exact matches first, then name/code prefix matches, then word matches;
+    # within each group countries come before states and other sub-regions
+    prefix = dataset.like_prefix(text)
+    cursor = db.cursor()
+    cursor.execute('''
+        SELECT r.id, r.name, r.code, r.region_type, r.parent_id, r.owner
+        FROM regions_fts JOIN regions r ON r.id = regions_fts.rowid
+        WHERE regions_fts MATCH ?
+        ORDER BY
+            CASE WHEN r.code = ? COLLATE NOCASE OR r.name = ? COLLATE NOCASE THEN 0
+                 WHEN r.name LIKE ? ESCAPE '\\' OR r.code LIKE ? ESCAPE '\\' THEN 1
+                 ELSE 2 END,
+            CASE r.region_type WHEN 'country' THEN 0 WHEN 'state' THEN 1 ELSE 2 END,
+            r.name
+        LIMIT ?
+    ''', (terms, text, text, prefix, prefix, limit))
+    results = cursor.fetchall()
+    db.close()
+
+    return jsonify([dict(row) for row in results])
+
+@app.route('/api/regions/nearest', methods=['GET'])
+def get_nearest_regions():
+    """Get the k regions closest to a point by centroid or boundary distance"""
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        k = int(request.args.get('k', 5))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat and lon are required numbers, k must be an integer'}), 400
+
+    mode = request.args.get('by', 'centroid')
+    if mode not in ('centroid', 'boundary'):
+        return jsonify({'error': "by must be 'centroid' or 'boundary'"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'lat/lon out of range'}), 400
+    k = max(1, min(k, 100))
+
+    db = get_db()
+    tree = get_nearest_tree(db)
+    attributes = get_region_attributes(db)
+    region_type = request.args.get('type', None)
+
+    def current(region):
+        return dict(region, **attributes.get(region['id'], {}))
+
+    def of_type(region):
+        return attributes.get(region['id'], region)['region_type'] == region_type
+
+    def distance_to_boundary(region, lon, lat):
+        geometry = tree.geometry_cache.get(region['id'])
+        if geometry is None:
+            cursor = db.cursor()
+            cursor.execute('SELECT geojson_data FROM regions WHERE id = ?', (region['id'],))
+            row = cursor.fetchone()
+            geometry = json.loads(row['geojson_data']) if row and row['geojson_data'] else {}
+            tree.geometry_cache[region['id']] = geometry
+        return boundary_distance(geometry, lon, lat)
+
+    results = tree.nearest(lon, lat, k=k, mode=mode, predicate=of_type if region_type else None,
+                           boundary_distance=distance_to_boundary)
+    db.close()
+
+    return jsonify([
+        dict(current(region), distance_km=round(distance, 3))
+        for region, distance in results
+    ])
+
+# Point-location grid for batch reverse geocoding, over every region. It only holds
+# geometry (bboxes and parsed polygons), so it is rebuilt when geometry_version changes,
+# not on attribute-only writes; current names, codes and types come from get_region_attributes()
+_locate_index = {'geometry_version': None, 'grid': None}
+_locate_lock = threading.Lock()
+
+def get_locate_grid(db):
+    """Return the point-location grid, rebuilding it if some geometry changed"""
+    geometry_version = dataset.get_version(db, 'geometry_version')
+    with _locate_lock:
+        if _locate_index['geometry_version'] != geometry_version:
+            _locate_index['grid'] = reverse_geocode.load_grid(db)
+            _locate_index['geometry_version'] = geometry_version
+        return _locate_index['grid']
+
+@app.route('/api/regions/locate', methods=['POST'])
+def locate_points():
+    """
+    Tag a batch of points with the region containing each.
+    A JSON body {"points": [[lon, lat], ...]} streams back a JSON array with one region
+    (or null) per point; a text/csv body streams back the CSV with region columns appended.
+    """
+    if request.mimetype == 'text/csv':
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    else:
+        data = request.get_json(silent=True) or {}
+        try:
+            points = reverse_geocode.parse_points(data.get('points', []))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    db = get_db()
+    grid = get_locate_grid(db)
+    attributes = get_region_attributes(db)
+    region_type = request.args.get('type', None)
+    load_geometries = reverse_geocode.geometry_loader(db)
+
+    if request.mimetype == 'text/csv':
+        chunks = reverse_geocode.tag_csv(lines, grid, load_geometries,
+                                         request.args.get('lon_column'), request.args.get('lat_column'),
+                                         attributes=attributes, region_type=region_type)
+        try:
+            header = next(chunks, '')
+        except ValueError as e:
+            db.close()
+            return jsonify({'error': str(e)}), 400
+        response = Response(stream_with_context(itertools.chain([header], chunks)), mimetype='text/csv')
+    else:
+        def generate():
+            yield '['
+            separator = ''
+            for regions in reverse_geocode.tag_points(points, grid, load_geometries,
+                                                       attributes=attributes, region_type=region_type):
+                yield separator + ','.join(json.dumps(reverse_geocode.region_summary(r)) for r in regions)
+                separator = ','
+            yield ']'
+        response = Response(generate(), mimetype='application/json')
+
+    response.call_on_close(db.close)
+    return response
+
+@app.route('/api/stats/aggregates', methods=['GET'])
+def get_aggregates():
+    """Region counts, total area and member codes per owner, continent or region type"""
+    group_by = request.args.get('group_by', 'owner')
+    if group_by not in dataset.AGGREGATE_GROUPS:
+        return jsonify({'error': f"group_by must be one of: {', '.join(dataset.AGGREGATE_GROUPS)}"}), 400
+
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''
+        SELECT group_key, region_count, total_area_km2, area_by_type_km2, member_codes
+        FROM region_aggregates WHERE group_by = ? ORDER BY region_count DESC, group_key
+    ''', (group_by,))
     rows = cursor.fetchall()
     db.close()
 
-    features = []
-    for row in rows:
-        geojson = json.loads(row['geojson_data'])
-        # Add or override properties to carry needed info (code, owner, parent_id)
-        if 'properties' not in geojson:
-            geojson['properties'] = {}
-        geojson['properties'].update({
-            'owner': row['owner'],
-            'code': row['code'],
-            'parent_id': row['parent_id']
-        })
-        features.append(geojson)
-
-    merged = {
-        "type": "FeatureCollection",
-        "features": features
-    }
+    return jsonify([{
+        'group': row['group_key'] or None,
+        'region_count': row['region_count'],
+        'total_area_km2': row['total_area_km2'],
+        'area_km2_by_type': json.loads(row['area_by_type_km2'] or '{}'),
+        'member_codes': json.loads(row['member_codes'])
+    } for row in rows])
+
+@app.route('/api/owners/<path:owner>/outline', methods=['GET'])
+def get_owner_outline(owner):
+    """Dissolved outline of all regions held by an owner, without internal borders"""
+    db = get_db()
+    outline = dataset.get_owner_outline(db, owner)
+    db.close()
+
+    if outline is None:
+        return jsonify({'error': 'Owner has no regions'}), 404
+    return Response(outline, mimetype='application/json')
+
+def geometry_response(db, region_id=None, code=None):
+    """Serve one region's geojson_data from the pack, or from the database if the pack is stale"""
+    located = geometry_pack.locate(dataset.geometry_pack_key(db), region_id=region_id, code=code)
+    if located:
+        db.close()
+        return geometry_pack.response(located)
+
+    cursor = db.cursor()
+    if region_id is not None:
+        cursor.execute('SELECT geojson_data FROM regions WHERE id = ?', (region_id,))
+    else:
+        cursor.execute('SELECT geojson_data FROM regions WHERE code = ?', (code,))
+    row = cursor.fetchone()
+    db.close()
+
+    if row and row['geojson_data']:
+        return Response(row['geojson_data'], mimetype='application/json')
+    return jsonify({'error': 'Region geometry not found'}), 404
+
+@app.route('/api/region/<int:region_id>/geometry', methods=['GET'])
+def get_region_geometry(region_id):
+    """Get only the GeoJSON geometry of a region"""
+    return geometry_response(get_db(), region_id=region_id)
+
+@app.route('/api/region/code/<code>/geometry', methods=['GET'])
+def get_region_geometry_by_code(code):
+    """Get only the GeoJSON geometry of a region, by code"""
+    return geometry_response(get_db(), code=code)
+
+@app.route('/api/geometry/pack', methods=['GET'])
+def get_geometry_pack():
+    """The whole geometry pack; supports Range requests using offsets from the index"""
+    db = get_db()
+    data_path = geometry_pack.data_path(dataset.geometry_pack_key(db))
+    db.close()
 
-    return jsonify(merged)
+    if data_path is None:
+        return jsonify({'error': 'Geometry pack is missing or out of date; run export_geometry_pack.py'}), 404
+    return send_file(os.path.abspath(data_path), mimetype='application/octet-stream', conditional=True)
+
+@app.route('/api/geometry/pack/index', methods=['GET'])
+def get_geometry_pack_index():
+    """Offsets of every region in the geometry pack"""
+    db = get_db()
+    data_path = geometry_pack.data_path(dataset.geometry_pack_key(db))
+    db.close()
+
+    if data_path is None:
+        return jsonify({'error': 'Geometry pack is missing or out of date; run export_geometry_pack.py'}), 404
+    return send_file(os.path.abspath(geometry_pack.index_path), mimetype='application/json', conditional=True)
 
 @app.route('/api/region/<int:region_id>', methods=['GET'])
 def get_region(region_id):
@@ -127,12 +510,27 @@ def get_region_by_code(code):
         return jsonify(dict(region))
     return jsonify({'error': 'Region not found'}), 404
 
-@app.route('/api/region', methods=['POST'])
-def create_region():
-    """Create a new region"""
-    data = request.get_json()
+def write(operation):
+    """Run operation(db) and commit it, batched through the group-commit queue when enabled"""
+    if write_queue is not None:
+        return write_queue.submit(operation)
 
+    # Take the write lock before operation reads anything (see dataset.aggregate_snapshot)
     db = get_db()
+    db.isolation_level = None
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        result = operation(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def insert_region(db, data):
+    """Insert a region and update everything derived from it; the caller commits"""
     cursor = db.cursor()
     cursor.execute('''
         INSERT INTO regions (name, code, parent_id, region_type, geojson_data, custom_data, owner)
@@ -146,19 +544,20 @@ def create_region():
         data.get('custom_data'),
         data.get('owner')
     ))
-    db.commit()
     region_id = cursor.lastrowid
-    db.close()
-
-    return jsonify({'id': region_id, 'message': 'Region created successfully'}), 201
-
-@app.route('/api/region/<int:region_id>', methods=['PUT'])
-def update_region(region_id):
-    """Update an existing region"""
-    data = request.get_json()
+    dataset.refresh_geometry_columns(db, [region_id])
+    after = dataset.aggregate_snapshot(db, region_id)
+    dataset.apply_aggregate_change(db, None, after)
+    dataset.invalidate_owner_outlines(db, [after['group_owner']])
+    dataset.bump_version(db, geometry_changed=data.get('geojson_data') is not None, region_ids=[region_id])
+    return region_id
 
-    db = get_db()
+def replace_region(db, region_id, data):
+    """Overwrite a region and update everything derived from it; the caller commits"""
     cursor = db.cursor()
+    # Taken under the write lock, so a concurrent write cannot change the row in between
+    before = dataset.aggregate_snapshot(db, region_id)
+    geometry_changed = dataset.geometry_changed(db, region_id, data.get('geojson_data'))
     cursor.execute('''
         UPDATE regions
         SET name = ?, code = ?, parent_id = ?, region_type = ?,
@@ -174,11 +573,35 @@ def update_region(region_id):
         data.get('owner'),
         region_id
     ))
-    db.commit()
-    db.close()
+    dataset.refresh_geometry_columns(db, [region_id])
+    after = dataset.aggregate_snapshot(db, region_id)
+    dataset.apply_aggregate_change(db, before, after)
+    dataset.invalidate_owner_outlines(db, [snapshot['group_owner'] for snapshot in (before, after) if snapshot])
+    dataset.bump_version(db, geometry_changed=geometry_changed, region_ids=[region_id])
+
+@app.route('/api/region', methods=['POST'])
+def create_region():
+    """Create a new region"""
+    data = request.get_json()
+    region_id = write(lambda db: insert_region(db, data))
+
+    return jsonify({'id': region_id, 'message': 'Region created successfully'}), 201
+
+@app.route('/api/region/<int:region_id>', methods=['PUT'])
+def update_region(region_id):
+    """Update an existing region"""
+    data = request.get_json()
+    write(lambda db: replace_region(db, region_id, data))
 
     return jsonify({'message': 'Region updated successfully'})
 
+@app.route('/api/metrics/write_queue', methods=['GET'])
+def get_write_queue_metrics():
+    """Group-commit counters for this worker process"""
+    if write_queue is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(write_queue.stats(), enabled=True))
+
 if __name__ == '__main__':
     init_db()
     print("\n" + "="*60)
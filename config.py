@@ -16,3 +16,65 @@ FLASK_CONFIG = {
     'host': '0.0.0.0',
     'port': 5000
 }
+
+# custom_data keys promoted to indexed generated columns (custom_<key>),
+# so /api/regions?custom.<key>=value filters run on an index
+PROMOTED_CUSTOM_KEYS = ['continent', 'region_un', 'subregion', 'iso_a2']
+
+# Production server (serve.py)
+SERVER_CONFIG = {
+    'backend': 'sqlite',     # 'sqlite' (app_sqlite.py) or 'mysql' (app.py)
+    'bind': '0.0.0.0:5000',
+    'workers': 4,
+    'threads': 4,
+    'timeout': 60,
+    'graceful_timeout': 30,
+    # Requests replayed once in the master process before workers are forked. Only
+    # paths that build in-process state are worth listing: the nearest ball tree and
+    # region attributes, and the geometry pack index. Responses are not cached, so
+    # list endpoints would be computed and thrown away
+    'warm_up_paths': [
+        '/api/regions/nearest?lat=0&lon=0',
+        '/api/geometry/pack/index',
+    ],
+}
+
+# Geometry pack written by export_geometry_pack.py (and at the end of every import);
+# the index lives next to it as <path>.json
+GEOMETRY_PACK = 'database/geometry.pack'
+
+# Directory for cross-process single-flight coalescing between worker processes;
+# None coalesces concurrent identical requests within each process only
+SINGLEFLIGHT_DIR = 'database/singleflight'
+
+# Optional group-commit write path for create/update: writes are queued and
+# committed together (at most max_batch per commit, waiting at most max_delay_ms).
+# A request whose write is not picked up within submit_timeout_s fails instead of hanging
+WRITE_QUEUE = {
+    'enabled': False,
+    'max_batch': 64,
+    'max_delay_ms': 5,
+    'submit_timeout_s': 30,
+}
+
+# Where the importers write: 'sqlite' (database/globe.db) or 'mysql' (DB_CONFIG).
+# MySQL rows are sent as multi-row INSERTs of at most batch_rows rows and
+# batch_bytes bytes (keep it below max_allowed_packet), or with
+# mysql_load = 'infile' as one LOAD DATA LOCAL INFILE (needs local_infile=ON)
+IMPORT_CONFIG = {
+    'backend': 'sqlite',
+    'mysql_load': 'insert',
+    'batch_rows': 1000,
+    'batch_bytes': 16 * 1024 * 1024,
+}
+
+# Importer downloads (download_cache.py): cached copies younger than
+# max_age_seconds are used without a request, older ones are revalidated with
+# ETag / Last-Modified. offline uses only cached copies and local files.
+# checksums maps a URL to the SHA-256 its download must have.
+DOWNLOAD_CACHE = {
+    'directory': 'database/downloads',
+    'max_age_seconds': 24 * 3600,
+    'offline': False,
+    'checksums': {},
+}
@@ -0,0 +1,581 @@
+"""
+Schema additions and derived data shared by both servers and the importers
+Works with a sqlite3 connection or a pymysql connection (DictCursor)
+"""
+import bisect
+import json
+import random
+import re
+import sqlite3
+from config import PROMOTED_CUSTOM_KEYS
+from geometry import geometry_stats, dissolve
+
+# Columns derived from geojson_data, filled in at import/write time
+GEOMETRY_COLUMNS = {
+    'centroid_lon': 'DOUBLE',
+    'centroid_lat': 'DOUBLE',
+    'radius_km': 'DOUBLE',
+    'vertex_count': 'INTEGER',
+    'ring_count': 'INTEGER',
+    'area_km2': 'DOUBLE',
+    'perimeter_km': 'DOUBLE',
+    'bbox_min_lon': 'DOUBLE',
+    'bbox_min_lat': 'DOUBLE',
+    'bbox_max_lon': 'DOUBLE',
+    'bbox_max_lat': 'DOUBLE',
+}
+
+# Groupings maintained in the region_aggregates table: name -> custom_data key or column
+AGGREGATE_GROUPS = {
+    'owner': 'owner',
+    'continent': 'custom.continent',
+    'region_type': 'region_type',
+}
+
+# Regions are processed in chunks so a full refresh does not hold every geometry in memory
+STATS_BATCH_SIZE = 500
+
+
+def is_sqlite(db):
+    return isinstance(db, sqlite3.Connection)
+
+
+def placeholder(db):
+    return '?' if is_sqlite(db) else '%s'
+
+
+def existing_columns(db, table='regions'):
+    cursor = db.cursor()
+    if is_sqlite(db):
+        cursor.execute(f'PRAGMA table_xinfo({table})')
+        return {row[1] for row in cursor.fetchall()}
+    cursor.execute('''
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ''', (table,))
+    return {row['COLUMN_NAME'] for row in cursor.fetchall()}
+
+
+def existing_indexes(db, table='regions'):
+    cursor = db.cursor()
+    if is_sqlite(db):
+        cursor.execute(f'PRAGMA index_list({table})')
+        return {row[1] for row in cursor.fetchall()}
+    cursor.execute('''
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ''', (table,))
+    return {row['INDEX_NAME'] for row in cursor.fetchall()}
+
+
+def valid_custom_key(key):
+    return re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', key) is not None
+
+
+def _mysql_custom_expression(key):
+    # JSON_UNQUOTE turns a JSON null into the string 'null'; map it to NULL like SQLite's json_extract
+    value = f"JSON_EXTRACT(custom_data, '$.{key}')"
+    return f"IF(JSON_VALID(custom_data), IF(JSON_TYPE({value}) = 'NULL', NULL, JSON_UNQUOTE({value})), NULL)"
+
+
+def custom_key_expression(db, key):
+    """
+    SQL expression for a custom_data key. Promoted keys use their indexed
+    generated column; other keys are extracted from the JSON in the database.
+    """
+    if not valid_custom_key(key):
+        raise ValueError(f'Invalid custom_data key: {key}')
+    if key in PROMOTED_CUSTOM_KEYS:
+        return f'custom_{key}'
+    if is_sqlite(db):
+        return f"CASE WHEN json_valid(custom_data) THEN json_extract(custom_data, '$.{key}') END"
+    return _mysql_custom_expression(key)
+
+
+def ensure_custom_columns(db):
+    """Add a virtual generated column and an index for each promoted custom_data key"""
+    cursor = db.cursor()
+    columns = existing_columns(db)
+    indexes = existing_indexes(db)
+    expressions = {}
+    if not is_sqlite(db):
+        cursor.execute('''
+            SELECT COLUMN_NAME AS name, GENERATION_EXPRESSION AS expression FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'regions'
+        ''')
+        expressions = {row['name']: row['expression'] or '' for row in cursor.fetchall()}
+    for key in PROMOTED_CUSTOM_KEYS:
+        if not valid_custom_key(key):
+            raise ValueError(f'Invalid custom_data key in PROMOTED_CUSTOM_KEYS: {key}')
+        column = f'custom_{key}'
+        if column not in columns:
+            if is_sqlite(db):
+                cursor.execute(f"""
+                    ALTER TABLE regions ADD COLUMN {column} TEXT GENERATED ALWAYS AS (
+                        CASE WHEN json_valid(custom_data) THEN json_extract(custom_data, '$.{key}') END
+                    ) VIRTUAL
+                """)
+            else:
+                cursor.execute(f"""
+                    ALTER TABLE regions ADD COLUMN {column} VARCHAR(255) AS ({_mysql_custom_expression(key)}) VIRTUAL
+                """)
+        elif not is_sqlite(db) and 'json_type' not in expressions.get(column, '').lower():
+            # Created before JSON nulls were mapped to NULL
+            cursor.execute(f"""
+                ALTER TABLE regions MODIFY COLUMN {column} VARCHAR(255) AS ({_mysql_custom_expression(key)}) VIRTUAL
+            """)
+        if f'idx_regions_{column}' not in indexes:
+            cursor.execute(f'CREATE INDEX idx_regions_{column} ON regions ({column})')
+
+
+def ensure_search_index(db):
+    """
+    Full-text index over name and code for /api/regions/search.
+    SQLite uses an external-content FTS5 table kept in sync by triggers;
+    MySQL uses a FULLTEXT index plus a plain index on name for prefix scans.
+    """
+    cursor = db.cursor()
+    if is_sqlite(db):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'regions_fts'")
+        if cursor.fetchone():
+            return
+        cursor.execute('''
+            CREATE VIRTUAL TABLE regions_fts USING fts5(
+                name, code, content='regions', content_rowid='id', prefix='1 2 3'
+            )
+        ''')
+        create_search_triggers(db)
+        cursor.execute("INSERT INTO regions_fts(regions_fts) VALUES ('rebuild')")
+        return
+
+    indexes = existing_indexes(db)
+    if 'idx_regions_name' not in indexes:
+        cursor.execute('CREATE INDEX idx_regions_name ON regions (name)')
+    if 'ft_regions_name_code' not in indexes:
+        cursor.execute('CREATE FULLTEXT INDEX ft_regions_name_code ON regions (name, code)')
+
+
+# Keep the SQLite FTS5 table in step with regions, row by row
+SEARCH_TRIGGERS = {
+    'regions_fts_insert': '''
+        CREATE TRIGGER regions_fts_insert AFTER INSERT ON regions BEGIN
+            INSERT INTO regions_fts(rowid, name, code) VALUES (new.id, new.name, new.code);
+        END
+    ''',
+    'regions_fts_delete': '''
+        CREATE TRIGGER regions_fts_delete AFTER DELETE ON regions BEGIN
+            INSERT INTO regions_fts(regions_fts, rowid, name, code) VALUES ('delete', old.id, old.name, old.code);
+        END
+    ''',
+    'regions_fts_update': '''
+        CREATE TRIGGER regions_fts_update AFTER UPDATE OF name, code ON regions BEGIN
+            INSERT INTO regions_fts(regions_fts, rowid, name, code) VALUES ('delete', old.id, old.name, old.code);
+            INSERT INTO regions_fts(rowid, name, code) VALUES (new.id, new.name, new.code);
+        END
+    ''',
+}
+
+
+def create_search_triggers(db):
+    cursor = db.cursor()
+    for sql in SEARCH_TRIGGERS.values():
+        cursor.execute(sql)
+
+
+def drop_search_triggers(db):
+    """
+    For bulk writes on SQLite: maintaining FTS row by row costs far more than one
+    rebuild. Call create_search_triggers() and rebuild_search_index() afterwards.
+    """
+    cursor = db.cursor()
+    for name in SEARCH_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def rebuild_search_index(db):
+    """
+    Resynchronise the FTS5 table. Needed after imports because INSERT OR REPLACE
+    removes the old row without firing the delete trigger.
+    """
+    if is_sqlite(db):
+        db.cursor().execute("INSERT INTO regions_fts(regions_fts) VALUES ('rebuild')")
+
+
+def search_terms(db, text):
+    """Turn user input into a prefix query where every word must prefix-match a token"""
+    words = re.findall(r'\w+', text)
+    if is_sqlite(db):
+        return ' '.join(f'"{word}"*' for word in words)
+    return ' '.join(f'+{word}*' for word in words)
+
+
+def like_prefix(text):
+    """LIKE pattern matching values that start with text"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def ensure_schema(db):
+    """Add derived columns and bookkeeping tables to an existing regions table"""
+    cursor = db.cursor()
+    columns = existing_columns(db)
+    for name, sql_type in GEOMETRY_COLUMNS.items():
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE regions ADD COLUMN {name} {sql_type}')
+    if 'row_version' not in columns:
+        # Dataset version of each row's last write, for incremental replication (replicate.py)
+        cursor.execute('ALTER TABLE regions ADD COLUMN row_version BIGINT')
+        cursor.execute('UPDATE regions SET row_version = 0')
+        cursor.execute('CREATE INDEX idx_regions_row_version ON regions (row_version)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_meta (
+            name VARCHAR(64) PRIMARY KEY,
+            value BIGINT NOT NULL
+        )
+    ''')
+    ensure_custom_columns(db)
+    ensure_search_index(db)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS owner_outlines (
+            owner VARCHAR(255) PRIMARY KEY,
+            region_count INTEGER NOT NULL,
+            geojson_data LONGTEXT NOT NULL
+        )
+    ''')
+    if ensure_aggregates(db):
+        # Aggregates read the area column, so existing rows need their statistics first
+        refresh_geometry_columns(db)
+        rebuild_aggregates(db)
+    for name in ('version', 'geometry_version'):
+        cursor.execute('SELECT value FROM dataset_meta WHERE name = ' + placeholder(db), (name,))
+        if cursor.fetchone() is None:
+            cursor.execute('INSERT INTO dataset_meta (name, value) VALUES (' + placeholder(db) + ', 1)', (name,))
+    cursor.execute('SELECT value FROM dataset_meta WHERE name = ' + placeholder(db), ('dataset_id',))
+    if cursor.fetchone() is None:
+        # Random identity of this database, so a geometry pack exported from another one is never served
+        cursor.execute(f'INSERT INTO dataset_meta (name, value) VALUES ({placeholder(db)}, {placeholder(db)})',
+                       ('dataset_id', random.getrandbits(62)))
+    db.commit()
+
+
+def get_version(db, name='version'):
+    """
+    Current dataset version; bumped on every write so caches can tell they are stale.
+    'geometry_version' only moves when some region's geojson_data changes.
+    """
+    cursor = db.cursor()
+    cursor.execute('SELECT value FROM dataset_meta WHERE name = ' + placeholder(db), (name,))
+    row = cursor.fetchone()
+    return row['value'] if row else 0
+
+
+def geometry_pack_key(db):
+    """(dataset_id, geometry_version): the geometry pack is current only if its index records both"""
+    cursor = db.cursor()
+    ph = placeholder(db)
+    cursor.execute(f'SELECT name, value FROM dataset_meta WHERE name IN ({ph}, {ph})', ('dataset_id', 'geometry_version'))
+    values = {row['name']: row['value'] for row in cursor.fetchall()}
+    return values.get('dataset_id'), values.get('geometry_version', 0)
+
+
+def bump_version(db, geometry_changed=False, region_ids=None):
+    """
+    Args:
+        region_ids: rows changed by this write; their row_version is set to the new version
+    """
+    cursor = db.cursor()
+    names = ('version', 'geometry_version') if geometry_changed else ('version',)
+    for name in names:
+        cursor.execute('UPDATE dataset_meta SET value = value + 1 WHERE name = ' + placeholder(db), (name,))
+    if region_ids:
+        region_ids = list(region_ids)
+        stamp_rows(db, f'id IN ({", ".join([placeholder(db)] * len(region_ids))})', region_ids)
+
+
+def stamp_rows(db, condition, params=()):
+    """Set row_version to the current dataset version for the rows matching an SQL condition"""
+    cursor = db.cursor()
+    cursor.execute(f'UPDATE regions SET row_version = {placeholder(db)} WHERE {condition}',
+                   [get_version(db)] + list(params))
+
+
+def geometry_changed(db, region_id, geojson_text):
+    """
+    Whether writing geojson_text to a region would change its geometry (compared in the database).
+    Locks the row like aggregate_snapshot().
+    """
+    ph = placeholder(db)
+    same = 'IS' if is_sqlite(db) else '<=>'
+    lock = '' if is_sqlite(db) else ' FOR UPDATE'
+    cursor = db.cursor()
+    cursor.execute(f'SELECT geojson_data {same} {ph} AS same FROM regions WHERE id = {ph}{lock}',
+                   (geojson_text, region_id))
+    row = cursor.fetchone()
+    return row is None or not row['same']
+
+
+def geometry_columns(geojson_texts):
+    """Compute the derived geometry columns for a list of geojson_data values"""
+    geometries = []
+    for text in geojson_texts:
+        try:
+            geometries.append(json.loads(text) if text else None)
+        except (TypeError, ValueError):
+            geometries.append(None)
+    return [stats or dict.fromkeys(GEOMETRY_COLUMNS) for stats in geometry_stats(geometries)]
+
+
+def refresh_geometry_columns(db, region_ids=None, table='regions'):
+    """
+    Recompute derived geometry columns.
+
+    Args:
+        region_ids: ids to refresh; None refreshes every row that is missing them
+        table: regions, or a staging table with the same columns
+    """
+    ph = placeholder(db)
+    cursor = db.cursor()
+    if region_ids is None:
+        cursor.execute(f'SELECT id FROM {table} WHERE vertex_count IS NULL AND geojson_data IS NOT NULL')
+        region_ids = [row['id'] for row in cursor.fetchall()]
+
+    assignments = ', '.join(f'{name} = {ph}' for name in GEOMETRY_COLUMNS)
+    region_ids = list(region_ids)
+    for i in range(0, len(region_ids), STATS_BATCH_SIZE):
+        batch = region_ids[i:i + STATS_BATCH_SIZE]
+        cursor.execute(f'SELECT id, geojson_data FROM {table} WHERE id IN ({", ".join([ph] * len(batch))})', batch)
+        rows = cursor.fetchall()
+        stats = geometry_columns([row['geojson_data'] for row in rows])
+        cursor.executemany(f'UPDATE {table} SET {assignments} WHERE id = {ph}', [
+            [values[name] for name in GEOMETRY_COLUMNS] + [row['id']]
+            for row, values in zip(rows, stats)
+        ])
+    return len(region_ids)
+
+
+def _group_expression(db, group_by):
+    source = AGGREGATE_GROUPS[group_by]
+    if source.startswith('custom.'):
+        return custom_key_expression(db, source[len('custom.'):])
+    return source
+
+
+def _aggregate_select(db):
+    expressions = ', '.join(f'{_group_expression(db, name)} AS group_{name}' for name in AGGREGATE_GROUPS)
+    return f'SELECT code, area_km2, region_type, {expressions} FROM regions'
+
+
+def ensure_aggregates(db):
+    """Create or upgrade the materialized aggregates table; returns True if it needs a rebuild"""
+    cursor = db.cursor()
+    if is_sqlite(db):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'region_aggregates'")
+    else:
+        cursor.execute("SHOW TABLES LIKE 'region_aggregates'")
+    if cursor.fetchone():
+        if 'area_by_type_km2' in existing_columns(db, 'region_aggregates'):
+            return False
+        # Tables from before the per-type areas (and, on MySQL, before JSON nulls mapped to NULL)
+        cursor.execute('ALTER TABLE region_aggregates ADD COLUMN area_by_type_km2 LONGTEXT')
+        return True
+
+    cursor.execute('''
+        CREATE TABLE region_aggregates (
+            group_by VARCHAR(32) NOT NULL,
+            group_key VARCHAR(255) NOT NULL,
+            region_count INTEGER NOT NULL,
+            total_area_km2 DOUBLE NOT NULL,
+            member_codes LONGTEXT NOT NULL,
+            area_by_type_km2 LONGTEXT,
+            PRIMARY KEY (group_by, group_key)
+        )
+    ''')
+    return True
+
+
+def _nonzero_areas(by_type):
+    # Types whose members add up to no area are left out, so rebuilds and incremental updates agree
+    return {region_type: area for region_type, area in sorted(by_type.items()) if area > 1e-6}
+
+
+def rebuild_aggregates(db):
+    """
+    Recompute every aggregate from the regions table (reads no geometry or JSON).
+
+    total_area_km2 sums every member, so nested regions (a country and its states)
+    are counted at each level; area_by_type_km2 holds the sum per region_type.
+    """
+    cursor = db.cursor()
+    cursor.execute(_aggregate_select(db) + ' ORDER BY code')
+    groups = {}
+    for row in cursor.fetchall():
+        for name in AGGREGATE_GROUPS:
+            key = row[f'group_{name}']
+            group = groups.setdefault((name, '' if key is None else str(key)), [0, 0.0, [], {}])
+            area = row['area_km2'] or 0.0
+            group[0] += 1
+            group[1] += area
+            if row['code'] is not None:
+                group[2].append(row['code'])
+            region_type = row['region_type'] or ''
+            group[3][region_type] = group[3].get(region_type, 0.0) + area
+
+    ph = placeholder(db)
+    cursor.execute('DELETE FROM region_aggregates')
+    cursor.executemany(
+        f'INSERT INTO region_aggregates (group_by, group_key, region_count, total_area_km2, member_codes, '
+        f'area_by_type_km2) VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph})',
+        [(name, key, count, area, json.dumps(codes), json.dumps(_nonzero_areas(by_type)))
+         for (name, key), (count, area, codes, by_type) in groups.items()]
+    )
+
+
+def aggregate_snapshot(db, region_id):
+    """
+    The fields of one region that the aggregates depend on, or None if it does not exist.
+
+    The snapshot must be taken under the write lock, or two concurrent writes compute
+    their deltas from the same stale row: on MySQL the row is read with FOR UPDATE
+    (a locking read also sees rows committed after the transaction's read view), on
+    SQLite the caller must already be inside BEGIN IMMEDIATE.
+    """
+    lock = '' if is_sqlite(db) else ' FOR UPDATE'
+    cursor = db.cursor()
+    cursor.execute(_aggregate_select(db) + f' WHERE id = {placeholder(db)}{lock}', (region_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def apply_aggregate_change(db, old, new):
+    """
+    Incrementally move one region between groups.
+
+    Args:
+        old: aggregate_snapshot() before the write, or None for an insert
+        new: aggregate_snapshot() after the write, or None for a delete
+    """
+    ph = placeholder(db)
+    lock = '' if is_sqlite(db) else ' FOR UPDATE'
+    cursor = db.cursor()
+    for name in AGGREGATE_GROUPS:
+        for snapshot, delta in ((old, -1), (new, 1)):
+            if snapshot is None:
+                continue
+            key = snapshot[f'group_{name}']
+            key = '' if key is None else str(key)
+            cursor.execute(
+                f'SELECT region_count, total_area_km2, member_codes, area_by_type_km2 FROM region_aggregates '
+                f'WHERE group_by = {ph} AND group_key = {ph}{lock}', (name, key)
+            )
+            row = cursor.fetchone()
+            count, area, codes = (row['region_count'], row['total_area_km2'], json.loads(row['member_codes'])) \
+                if row else (0, 0.0, [])
+            by_type = json.loads(row['area_by_type_km2'] or '{}') if row else {}
+
+            count += delta
+            area += delta * (snapshot['area_km2'] or 0.0)
+            region_type = snapshot['region_type'] or ''
+            by_type[region_type] = by_type.get(region_type, 0.0) + delta * (snapshot['area_km2'] or 0.0)
+            by_type = _nonzero_areas(by_type)
+            code = snapshot['code']
+            if code is not None:
+                if delta > 0:
+                    bisect.insort(codes, code)
+                elif code in codes:
+                    codes.remove(code)
+
+            if count <= 0:
+                cursor.execute(f'DELETE FROM region_aggregates WHERE group_by = {ph} AND group_key = {ph}', (name, key))
+            elif row:
+                cursor.execute(
+                    f'UPDATE region_aggregates SET region_count = {ph}, total_area_km2 = {ph}, member_codes = {ph}, '
+                    f'area_by_type_km2 = {ph} WHERE group_by = {ph} AND group_key = {ph}',
+                    (count, max(area, 0.0), json.dumps(codes), json.dumps(by_type), name, key)
+                )
+            else:
+                cursor.execute(
+                    f'INSERT INTO region_aggregates (group_by, group_key, region_count, total_area_km2, member_codes, '
+                    f'area_by_type_km2) VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph})',
+                    (name, key, count, max(area, 0.0), json.dumps(codes), json.dumps(by_type))
+                )
+
+
+def invalidate_owner_outlines(db, owners=None):
+    """
+    Drop cached outlines so they are recomputed on next request.
+
+    Args:
+        owners: owners whose regions changed; None drops every cached outline
+    """
+    cursor = db.cursor()
+    if owners is None:
+        cursor.execute('DELETE FROM owner_outlines')
+        return
+    owners = [owner for owner in set(owners) if owner is not None]
+    if owners:
+        ph = placeholder(db)
+        cursor.execute(f'DELETE FROM owner_outlines WHERE owner IN ({", ".join([ph] * len(owners))})', owners)
+
+
+def get_owner_outline(db, owner):
+    """
+    Dissolved outline of every region held by owner as a serialized GeoJSON Feature,
+    or None if the owner has no regions. Computed once and cached in owner_outlines;
+    the cached geometry text is spliced into the response without re-parsing it.
+    """
+    ph = placeholder(db)
+    cursor = db.cursor()
+    cursor.execute(f'SELECT region_count, geojson_data FROM owner_outlines WHERE owner = {ph}', (owner,))
+    row = cursor.fetchone()
+    if row:
+        region_count, geometry_text = row['region_count'], row['geojson_data']
+    else:
+        version = get_version(db)
+        cursor.execute(f'SELECT id, parent_id, geojson_data FROM regions WHERE owner = {ph}', (owner,))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+
+        # A region whose parent has the same owner is already covered by the parent
+        owned = {row['id'] for row in rows}
+        geometries = [
+            json.loads(row['geojson_data']) for row in rows
+            if row['geojson_data'] and row['parent_id'] not in owned
+        ]
+        region_count = len(rows)
+        geometry_text = json.dumps(dissolve(geometries))
+
+        # Only cache if no write landed while we were computing. The version check is
+        # part of the REPLACE, so a write cannot commit between the check and the insert
+        cursor.execute(
+            f'REPLACE INTO owner_outlines (owner, region_count, geojson_data) '
+            f'SELECT {ph}, {ph}, {ph} FROM dataset_meta WHERE name = {ph} AND value = {ph}',
+            (owner, region_count, geometry_text, 'version', version)
+        )
+        db.commit()
+
+    properties = json.dumps({'owner': owner, 'region_count': region_count})
+    return f'{{"type": "Feature", "properties": {properties}, "geometry": {geometry_text}}}'
+
+
+def region_owners(db, condition, params=(), table='regions'):
+    """Distinct owners of the rows matching an SQL condition"""
+    cursor = db.cursor()
+    cursor.execute(f'SELECT DISTINCT owner FROM {table} WHERE {condition}', params)
+    return {row['owner'] for row in cursor.fetchall()}
+
+
+def publish_import(db, owners=None):
+    """
+    Rebuild everything derived from the whole table and publish a new version.
+    Does not commit, so it can run inside the transaction that changed the rows.
+
+    Args:
+        owners: owners of the changed rows, before and after the change, whose
+            cached outlines are dropped; None drops every cached outline
+    """
+    rebuild_search_index(db)
+    rebuild_aggregates(db)
+    invalidate_owner_outlines(db, owners)
+    bump_version(db, geometry_changed=True)
+
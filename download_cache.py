@@ -0,0 +1,210 @@
+"""
+On-disk cache for the importers' source downloads
+
+Every URL is stored once under DOWNLOAD_CACHE['directory'] (config.py) with its
+ETag, Last-Modified and SHA-256. A cached copy younger than max_age_seconds is
+used without touching the network. An older one is revalidated with
+If-None-Match / If-Modified-Since, so an unchanged source answers 304 and is not
+downloaded again. Interrupted downloads are kept as .part files and resumed
+with a Range request (If-Range makes sure the source did not change meanwhile).
+Downloads ask for Accept-Encoding: identity, so the bytes on disk are the bytes
+the Range offsets count.
+
+In offline mode (DOWNLOAD_CACHE['offline'], or --offline on the importers) only
+cached copies and local files are used.
+"""
+import hashlib
+import json
+import os
+import time
+import requests
+from config import DOWNLOAD_CACHE
+
+CHUNK_SIZE = 1024 * 1024
+
+# Network reads are small so an interrupted download keeps almost everything it received
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Importers set this from --offline
+offline_mode = DOWNLOAD_CACHE['offline']
+
+
+def cache_paths(url, cache_dir=None):
+    """(data file, metadata file) for a URL"""
+    directory = cache_dir or DOWNLOAD_CACHE['directory']
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(directory, key + '.data'), os.path.join(directory, key + '.json')
+
+
+def _read_meta(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path, meta):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _local_path(url):
+    if url.startswith('file://'):
+        return url[len('file://'):]
+    if '://' not in url:
+        return url
+    return None
+
+
+def _cached(data_path, meta, expected):
+    """Whether the cached copy exists and matches its recorded (and the expected) checksum"""
+    if meta is None or not os.path.exists(data_path):
+        return False
+    if os.path.getsize(data_path) != meta.get('size'):
+        return False
+    sha256 = file_sha256(data_path)
+    return sha256 == meta.get('sha256') and (expected is None or sha256 == expected)
+
+
+def fetch(url, sha256=None, offline=None, timeout=60, cache_dir=None, session=None):
+    """
+    Path of a local copy of url, downloading it only if needed.
+
+    Args:
+        url: http(s) URL, file:// URL or local path (local files are returned as they are)
+        sha256: expected checksum; defaults to DOWNLOAD_CACHE['checksums'].get(url)
+        offline: only use the cache; defaults to offline_mode
+        cache_dir, session: override the cache directory / requests session
+    Raises RuntimeError when offline and nothing is cached, ValueError on a checksum mismatch.
+    """
+    local = _local_path(url)
+    if local is not None:
+        if sha256 and file_sha256(local) != sha256:
+            raise ValueError(f"Checksum mismatch for {local}")
+        return local
+
+    offline = offline_mode if offline is None else offline
+    expected = sha256 or DOWNLOAD_CACHE['checksums'].get(url)
+    data_path, meta_path = cache_paths(url, cache_dir)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    meta = _read_meta(meta_path)
+    cached = _cached(data_path, meta, expected)
+
+    if offline:
+        if not cached:
+            raise RuntimeError(f"Offline and no cached copy of {url}")
+        print(f"  [CACHE] {url} (offline)")
+        return data_path
+    if cached and time.time() - meta.get('checked_at', 0) < DOWNLOAD_CACHE['max_age_seconds']:
+        print(f"  [CACHE] {url} (checked {time.time() - meta['checked_at']:.0f}s ago)")
+        return data_path
+
+    session = session or requests
+    headers = {}
+    if cached:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        return _download(url, session, headers, timeout, data_path, meta_path, meta if cached else None, expected)
+    except requests.RequestException as e:
+        if not cached:
+            raise
+        print(f"  [CACHE] {url} (revalidation failed: {e})")
+        return data_path
+
+
+def _download(url, session, headers, timeout, data_path, meta_path, meta, expected):
+    part_path = data_path + '.part'
+    part_meta_path = part_path + '.json'
+    part_meta = _read_meta(part_meta_path)
+
+    # Ranges count bytes of the encoded body, so a content-encoded (gzip) response would be
+    # decoded by requests and the resumed offset would point into the wrong stream
+    headers = dict(headers, **{'Accept-Encoding': 'identity'})
+
+    # Resume an interrupted download if the server can confirm it is the same file
+    resume_from = 0
+    if part_meta and part_meta.get('identity') and os.path.exists(part_path) \
+            and (part_meta.get('etag') or part_meta.get('last_modified')):
+        resume_from = os.path.getsize(part_path)
+        if resume_from:
+            headers['Range'] = f'bytes={resume_from}-'
+            headers['If-Range'] = part_meta.get('etag') or part_meta['last_modified']
+
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and meta is not None:
+            meta['checked_at'] = time.time()
+            _write_meta(meta_path, meta)
+            print(f"  [CACHE] {url} (not modified)")
+            return data_path
+        if response.status_code == 416 and resume_from:
+            # The part file is stale or already complete; start over
+            os.remove(part_path)
+            os.remove(part_meta_path)
+            return _download(url, session, {}, timeout, data_path, meta_path, meta, expected)
+        response.raise_for_status()
+
+        identity = response.headers.get('Content-Encoding', 'identity') == 'identity'
+        if response.status_code == 206 and not identity:
+            # The server ignored Accept-Encoding, so the range is of another stream; start over
+            os.remove(part_path)
+            os.remove(part_meta_path)
+            return _download(url, session, {}, timeout, data_path, meta_path, meta, expected)
+
+        resumed = response.status_code == 206
+        digest = hashlib.sha256()
+        if resumed:
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        else:
+            resume_from = 0
+
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if not resumed:
+            # A part file of a content-encoded body is never resumed
+            _write_meta(part_meta_path, dict(validators, url=url, identity=identity))
+        with open(part_path, 'ab' if resumed else 'wb') as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+
+    sha256 = digest.hexdigest()
+    if expected is not None and sha256 != expected:
+        os.remove(part_path)
+        os.remove(part_meta_path)
+        raise ValueError(f"Checksum mismatch for {url}: expected {expected}, got {sha256}")
+
+    os.replace(part_path, data_path)
+    os.remove(part_meta_path)
+    if resumed:
+        validators = {key: part_meta.get(key) for key in validators}
+    now = time.time()
+    _write_meta(meta_path, dict(validators, url=url, sha256=sha256, size=os.path.getsize(data_path),
+                                fetched_at=now, checked_at=now))
+    size = os.path.getsize(data_path)
+    note = f", resumed at {resume_from:,} bytes" if resumed else ''
+    print(f"  [DOWNLOAD] {url} ({size:,} bytes{note})")
+    return data_path
+
+
+def fetch_json(url, **kwargs):
+    """fetch() and parse the file as JSON"""
+    with open(fetch(url, **kwargs), encoding='utf-8') as f:
+        return json.load(f)
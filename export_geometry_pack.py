@@ -0,0 +1,25 @@
+"""
+Export every region's geometry into the memory-mapped pack served by the API
+Imports do this automatically; run it by hand after editing geometry via the API
+"""
+import sqlite3
+import dataset
+from geometry_pack import export_pack
+
+DATABASE = 'database/globe.db'
+
+def get_db():
+    """Connect to the SQLite database"""
+    db = sqlite3.connect(DATABASE)
+    db.row_factory = sqlite3.Row
+    return db
+
+if __name__ == '__main__':
+    print("="*60)
+    print("Geometry Pack Export")
+    print("="*60)
+
+    db = get_db()
+    dataset.ensure_schema(db)
+    export_pack(db, dataset.get_version(db, 'geometry_version'))
+    db.close()
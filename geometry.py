@@ -0,0 +1,417 @@
+"""
+Spherical geometry helpers for region boundaries
+All inputs are GeoJSON geometries (Polygon / MultiPolygon) in lon/lat degrees
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def polygons(geometry):
+    """Return the geometry as a list of polygons, each a list of (N, 2) lon/lat rings"""
+    if not geometry or not geometry.get('coordinates'):
+        return []
+
+    if geometry.get('type') == 'Polygon':
+        parts = [geometry['coordinates']]
+    elif geometry.get('type') == 'MultiPolygon':
+        parts = geometry['coordinates']
+    else:
+        return []
+
+    result = []
+    for part in parts:
+        rings = []
+        for ring in part:
+            if len(ring) < 3:
+                continue
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            rings.append(ring)
+        if rings:
+            result.append(rings)
+    return result
+
+
+def to_unit_vectors(lon, lat):
+    """Convert lon/lat degrees (scalars or arrays) to unit vectors on the sphere"""
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def to_lon_lat(vectors):
+    """Convert unit vectors back to lon/lat degrees"""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    lon = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0]))
+    lat = np.degrees(np.arctan2(vectors[..., 2], np.hypot(vectors[..., 0], vectors[..., 1])))
+    return lon, lat
+
+
+def angle_between(a, b):
+    """Central angle in radians between unit vectors (broadcasts over leading axes)"""
+    cross = np.linalg.norm(np.cross(a, b), axis=-1)
+    dot = np.sum(a * b, axis=-1)
+    return np.arctan2(cross, dot)
+
+
+def geometry_stats(geometries):
+    """
+    Compute statistics for many geometries in one vectorized pass.
+
+    Every ring of every geometry is concatenated into a single vertex array, so the
+    per-edge work (arc lengths, fan-triangle spherical excess) runs once in NumPy
+    and is reduced back to rings and regions with bincount.
+
+    Returns:
+        list of dicts (or None for empty geometries) with vertex_count, ring_count,
+        area_km2, perimeter_km, centroid_lon, centroid_lat, radius_km and
+        bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat
+    """
+    ring_arrays = []
+    ring_region = []
+    ring_is_hole = []
+    for index, geometry in enumerate(geometries):
+        for rings in polygons(geometry):
+            for i, ring in enumerate(rings):
+                ring_arrays.append(ring)
+                ring_region.append(index)
+                ring_is_hole.append(i > 0)
+
+    results = [None] * len(geometries)
+    if not ring_arrays:
+        return results
+
+    lengths = np.array([len(ring) for ring in ring_arrays])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    ring_region = np.array(ring_region)
+    lonlat = np.concatenate(ring_arrays)
+    v = to_unit_vectors(lonlat[:, 0], lonlat[:, 1])
+
+    # Edges run from each vertex to the next one in the same (closed) ring
+    ring_of_vertex = np.repeat(np.arange(len(lengths)), lengths)
+    is_last = np.zeros(len(v), dtype=bool)
+    is_last[starts + lengths - 1] = True
+    edge = ~is_last
+    a = v[starts[ring_of_vertex]][edge]
+    b = v[edge]
+    c = v[np.flatnonzero(edge) + 1]
+    edge_ring = ring_of_vertex[edge]
+
+    # Signed spherical excess of the fan triangle (first vertex, b, c) - Van Oosterom-Strackee.
+    # Triangles touching the fan apex are degenerate and contribute zero.
+    det = np.einsum('ij,ij->i', a, np.cross(b, c))
+    denom = 1.0 + np.einsum('ij,ij->i', a, b) + np.einsum('ij,ij->i', b, c) + np.einsum('ij,ij->i', c, a)
+    excess = 2.0 * np.arctan2(det, denom)
+    arcs = angle_between(b, c)
+
+    n_rings = len(lengths)
+    ring_excess = np.bincount(edge_ring, weights=excess, minlength=n_rings)
+    ring_moment = np.stack([
+        np.bincount(edge_ring, weights=excess * (a + b + c)[:, axis], minlength=n_rings)
+        for axis in range(3)
+    ], axis=1)
+    ring_perimeter = np.bincount(edge_ring, weights=arcs, minlength=n_rings)
+
+    # Normalise winding per ring; outer rings add, holes subtract
+    sign = np.where(ring_excess >= 0, 1.0, -1.0) * np.where(ring_is_hole, -1.0, 1.0)
+    n = len(geometries)
+    area = np.bincount(ring_region, weights=sign * ring_excess, minlength=n)
+    moment = np.stack([
+        np.bincount(ring_region, weights=sign * ring_moment[:, axis], minlength=n)
+        for axis in range(3)
+    ], axis=1)
+    perimeter = np.bincount(ring_region, weights=ring_perimeter, minlength=n)
+    ring_count = np.bincount(ring_region, minlength=n)
+    vertex_region = ring_region[ring_of_vertex]
+    vertex_count = np.bincount(vertex_region, minlength=n)
+
+    # Degenerate (zero area) regions fall back to the mean of their vertices
+    vertex_sum = np.stack([np.bincount(vertex_region, weights=v[:, axis], minlength=n) for axis in range(3)], axis=1)
+    norm = np.linalg.norm(moment, axis=1)
+    degenerate = norm < 1e-12
+    moment[degenerate] = vertex_sum[degenerate]
+    norm = np.linalg.norm(moment, axis=1)
+    center = moment / np.where(norm > 1e-12, norm, 1.0)[:, None]
+    center_lon, center_lat = to_lon_lat(center)
+
+    radius = np.zeros(n)
+    np.maximum.at(radius, vertex_region, angle_between(v, center[vertex_region]))
+
+    # Vertices are grouped by region in order, so bbox reductions can use reduceat
+    region_ids, region_starts = np.unique(vertex_region, return_index=True)
+    bbox_min = np.minimum.reduceat(lonlat, region_starts)
+    bbox_max = np.maximum.reduceat(lonlat, region_starts)
+
+    for row, index in enumerate(region_ids):
+        if norm[index] < 1e-12:
+            continue
+        results[index] = {
+            'vertex_count': int(vertex_count[index]),
+            'ring_count': int(ring_count[index]),
+            'area_km2': float(abs(area[index]) * EARTH_RADIUS_KM ** 2),
+            'perimeter_km': float(perimeter[index] * EARTH_RADIUS_KM),
+            'centroid_lon': float(center_lon[index]),
+            'centroid_lat': float(center_lat[index]),
+            'radius_km': float(radius[index] * EARTH_RADIUS_KM),
+            'bbox_min_lon': float(bbox_min[row, 0]),
+            'bbox_min_lat': float(bbox_min[row, 1]),
+            'bbox_max_lon': float(bbox_max[row, 0]),
+            'bbox_max_lat': float(bbox_max[row, 1]),
+        }
+    return results
+
+
+def contains_point(geometry, lon, lat):
+    """Even-odd point-in-polygon test in lon/lat space"""
+    for rings in polygons(geometry):
+        inside = False
+        for ring in rings:
+            x0, y0 = ring[:-1, 0], ring[:-1, 1]
+            x1, y1 = ring[1:, 0], ring[1:, 1]
+            crosses = (y0 > lat) != (y1 > lat)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_at = x0 + (lat - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= bool(np.count_nonzero(crosses & (lon < x_at)) % 2)
+        if inside:
+            return True
+    return False
+
+
+def contains_points(parts, lons, lats):
+    """
+    Vectorized contains_point for many points at once.
+
+    Args:
+        parts: the geometry as returned by polygons()
+        lons, lats: equal-length arrays of point coordinates
+    Returns:
+        boolean array, True where the point is inside
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    result = np.zeros(len(lons), dtype=bool)
+    for rings in parts:
+        stacked = np.vstack(rings)
+        (min_lon, min_lat), (max_lon, max_lat) = stacked.min(axis=0), stacked.max(axis=0)
+        # Only points inside the polygon's bbox and not yet matched need the crossing test
+        candidates = np.flatnonzero(
+            ~result & (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+        )
+        if len(candidates) == 0:
+            continue
+        inside = np.zeros(len(candidates), dtype=bool)
+        for ring in rings:
+            inside ^= _crossing_parity(ring, lons[candidates], lats[candidates])
+        result[candidates[inside]] = True
+    return result
+
+
+# Most (edge, point) pairs evaluated at once by _crossing_parity
+CROSSING_BLOCK_PAIRS = 1 << 22
+
+
+def _crossing_parity(ring, lons, lats):
+    """
+    Parity of the eastward ray crossings of each point with one closed ring.
+
+    An edge can only be crossed by points whose latitude lies in its [min, max)
+    band, so with the points sorted by latitude each edge is tested against one
+    contiguous slice of them instead of all of them.
+    """
+    x0, y0 = ring[:-1, 0], ring[:-1, 1]
+    x1, y1 = ring[1:, 0], ring[1:, 1]
+    keep = y0 != y1  # horizontal edges are never crossed
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    slope = (x1 - x0) / (y1 - y0)
+
+    order = np.argsort(lats, kind='stable')
+    sorted_lons, sorted_lats = lons[order], lats[order]
+    first = np.searchsorted(sorted_lats, np.minimum(y0, y1))
+    counts = np.searchsorted(sorted_lats, np.maximum(y0, y1)) - first
+    ends = np.cumsum(counts)
+
+    crossings = np.zeros(len(lons), dtype=np.int64)
+    e0 = 0
+    while e0 < len(counts):
+        done = ends[e0 - 1] if e0 else 0
+        e1 = max(e0 + 1, int(np.searchsorted(ends, done + CROSSING_BLOCK_PAIRS, side='right')))
+        block = counts[e0:e1]
+        total = int(block.sum())
+        if total:
+            edge = np.repeat(np.arange(e0, e1), block)
+            position = np.repeat(first[e0:e1] - (np.cumsum(block) - block), block) + np.arange(total)
+            x_at = x0[edge] + (sorted_lats[position] - y0[edge]) * slope[edge]
+            crossings += np.bincount(position[sorted_lons[position] < x_at], minlength=len(lons))
+        e0 = e1
+
+    parity = np.empty(len(lons), dtype=bool)
+    parity[order] = crossings % 2 == 1
+    return parity
+
+
+def boundary_distance(geometry, lon, lat):
+    """
+    Great-circle distance in km from a point to the nearest edge of the geometry.
+    Points inside the geometry are at distance 0.
+    """
+    parts = polygons(geometry)
+    if not parts:
+        return None
+    if contains_point(geometry, lon, lat):
+        return 0.0
+
+    q = to_unit_vectors(lon, lat)
+    best = np.pi
+    for rings in parts:
+        for ring in rings:
+            v = to_unit_vectors(ring[:, 0], ring[:, 1])
+            a, b = v[:-1], v[1:]
+            normal = np.cross(a, b)
+            length = np.linalg.norm(normal, axis=1)
+            valid = length > 1e-15
+            normal[valid] /= length[valid, None]
+
+            # Closest point on each edge's great circle, kept only if it lies inside the arc
+            offset = normal @ q
+            foot = q - offset[:, None] * normal
+            within = valid & (np.einsum('ij,ij->i', np.cross(a, foot), normal) >= 0) \
+                & (np.einsum('ij,ij->i', np.cross(foot, b), normal) >= 0)
+            to_arc = np.where(within, np.arcsin(np.clip(np.abs(offset), 0.0, 1.0)), np.pi)
+            to_ends = np.minimum(angle_between(a, q), angle_between(b, q))
+            best = min(best, float(np.minimum(to_arc, to_ends).min()))
+
+    return best * EARTH_RADIUS_KM
+
+
+def simplify(geometry, tolerance):
+    """
+    Douglas-Peucker simplification of every ring, in lon/lat degrees.
+
+    Rings that collapse below 4 points are dropped, and so are polygons whose
+    outer ring collapses. Returns a MultiPolygon (or None if nothing is left).
+    """
+    result = []
+    for rings in polygons(geometry):
+        kept = []
+        for i, ring in enumerate(rings):
+            ring = ring[_simplify_mask(ring, tolerance)]
+            if len(ring) >= 4:
+                kept.append(ring.tolist())
+            elif i == 0:
+                break
+        if kept and len(kept[0]) >= 4:
+            result.append(kept)
+    return {'type': 'MultiPolygon', 'coordinates': result} if result else None
+
+
+def _simplify_mask(ring, tolerance):
+    """Boolean mask of the vertices of a closed ring that Douglas-Peucker keeps"""
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[0] = keep[-1] = True
+    if len(ring) < 4:
+        keep[:] = True
+        return keep
+
+    # A closed ring starts and ends on the same point, so split it at the vertex farthest from it
+    farthest = int(np.argmax(np.hypot(*(ring - ring[0]).T)))
+    keep[farthest] = True
+    stack = [(0, farthest), (farthest, len(ring) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = ring[start], ring[end]
+        points = ring[start + 1:end]
+        direction = b - a
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(*(points - a).T)
+        else:
+            distances = np.abs(direction[0] * (points[:, 1] - a[1]) - direction[1] * (points[:, 0] - a[0])) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            middle = start + 1 + index
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return keep
+
+
+def _signed_area(ring):
+    """Planar shoelace area in lon/lat space; positive when counter-clockwise"""
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def dissolve(geometries, precision=9):
+    """
+    Union a set of adjacent geometries into one MultiPolygon, removing shared borders.
+
+    Rings are oriented consistently (outer counter-clockwise, holes clockwise), so a
+    border shared by two neighbours appears once in each direction and both copies
+    cancel. The remaining edges are stitched back into rings. This is exact for
+    coverages whose neighbours share vertices along their common borders (as the
+    imported country and state datasets do); borders that do not line up vertex for
+    vertex are kept as they are rather than snapped.
+    """
+    edges = {}
+    for geometry in geometries:
+        for rings in polygons(geometry):
+            for i, ring in enumerate(rings):
+                counter_clockwise = _signed_area(ring) > 0
+                if counter_clockwise == (i > 0):
+                    ring = ring[::-1]
+                points = [tuple(p) for p in np.round(ring, precision)]
+                for start, end in zip(points[:-1], points[1:]):
+                    if start == end:
+                        continue
+                    if (end, start) in edges:
+                        edges[(end, start)] -= 1
+                        if edges[(end, start)] == 0:
+                            del edges[(end, start)]
+                    else:
+                        edges[(start, end)] = 1
+
+    outgoing = {}
+    for start, end in edges:
+        outgoing.setdefault(start, []).append(end)
+
+    rings = []
+    while outgoing:
+        first = next(iter(outgoing))
+        ring = [first]
+        point = first
+        while True:
+            targets = outgoing.get(point)
+            if not targets:
+                break
+            following = targets.pop()
+            if not targets:
+                del outgoing[point]
+            ring.append(following)
+            point = following
+            if point == first:
+                break
+        if len(ring) >= 4 and ring[0] == ring[-1]:
+            rings.append(np.array(ring))
+
+    outers = [ring for ring in rings if _signed_area(ring) > 0]
+    holes = [ring for ring in rings if _signed_area(ring) <= 0]
+    result = [[ring] for ring in outers]
+    for hole in holes:
+        lon, lat = hole[0]
+        for polygon in result:
+            if contains_point({'type': 'Polygon', 'coordinates': [polygon[0].tolist()]}, lon, lat):
+                polygon.append(hole)
+                break
+        else:
+            # No outer ring contains it (borders that did not line up); keep its outline as its own polygon
+            result.append([hole[::-1]])
+
+    return {
+        'type': 'MultiPolygon',
+        'coordinates': [[ring.tolist() for ring in polygon] for polygon in result]
+    }
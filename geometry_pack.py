@@ -0,0 +1,154 @@
+"""
+Geometry pack: every region's geojson_data, back to back in one file
+
+The index (<pack>.json) maps region ids and codes to (offset, length) and records
+the database (dataset_id) and geometry version the pack was built from, so a pack
+exported from another database sharing the path (a replica, the other backend) is
+never served. Each export writes a new data file
+and then atomically replaces the index, so readers never see an index pointing
+into the wrong data file.
+"""
+import json
+import mmap
+import os
+from flask import Response, request
+from config import GEOMETRY_PACK
+import dataset
+
+# Data files from older exports kept around for readers that still have them mapped
+KEEP_OLD_PACKS = 1
+
+
+def export_pack(db, geometry_version, path=GEOMETRY_PACK):
+    """Write the pack and its index; returns the number of regions written"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.splitext(os.path.basename(path))[0]
+    data_name = f'{base}-{geometry_version}.pack'
+    data_path = os.path.join(directory, data_name)
+
+    cursor = db.cursor()
+    cursor.execute('SELECT id, code, geojson_data FROM regions WHERE geojson_data IS NOT NULL ORDER BY id')
+
+    regions = {}
+    codes = {}
+    offset = 0
+    with open(data_path + '.tmp', 'wb') as f:
+        for row in cursor:
+            data = row['geojson_data'].encode('utf-8')
+            f.write(data)
+            regions[str(row['id'])] = [offset, len(data)]
+            if row['code'] is not None:
+                codes[row['code']] = row['id']
+            offset += len(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(data_path + '.tmp', data_path)
+
+    index = {
+        'dataset_id': dataset.get_version(db, 'dataset_id'),
+        'geometry_version': geometry_version,
+        'data_file': data_name,
+        'size': offset,
+        'regions': regions,
+        'codes': codes,
+    }
+    with open(path + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(path + '.json.tmp', path + '.json')
+
+    # Drop data files that no index refers to any more
+    old = sorted(
+        (name for name in os.listdir(directory)
+         if name.startswith(base + '-') and name.endswith('.pack') and name != data_name),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name))
+    )
+    for name in old[:max(0, len(old) - KEEP_OLD_PACKS)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+    print(f"Wrote geometry pack: {len(regions)} regions, {offset:,} bytes -> {data_path}")
+    return len(regions)
+
+
+class _PackState:
+    def __init__(self, index, data_path, mapped):
+        self.index = index
+        self.data_path = data_path
+        self.mapped = mapped
+
+
+class GeometryPack:
+    """
+    Read side of the pack. The data file is memory-mapped read-only, so every
+    worker process shares the same page-cache pages instead of holding its own copy.
+    """
+
+    def __init__(self, path=GEOMETRY_PACK):
+        self.path = path
+        self.index_path = path + '.json'
+        self._mtime = None
+        self._state = None
+
+    def _current(self):
+        """Reload the index if the export step replaced it"""
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._state = None, None
+            return None
+        if mtime != self._mtime:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            data_path = os.path.join(os.path.dirname(self.path) or '.', index['data_file'])
+            mapped = None
+            if index['size'] > 0:
+                with open(data_path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mtime, self._state = mtime, _PackState(index, data_path, mapped)
+        return self._state
+
+    def _current_for(self, key):
+        """The loaded pack if it was exported at key (dataset.geometry_pack_key), else None"""
+        state = self._current()
+        if state is None or (state.index.get('dataset_id'), state.index['geometry_version']) != tuple(key):
+            return None
+        return state
+
+    def data_path(self, key):
+        """Path of the pack data file if it is current for key (dataset.geometry_pack_key)"""
+        state = self._current_for(key)
+        return state.data_path if state else None
+
+    def locate(self, key, region_id=None, code=None):
+        """(state, offset, length) of one region, or None if the pack is missing, stale or lacks it"""
+        state = self._current_for(key)
+        if state is None:
+            return None
+        if region_id is None:
+            region_id = state.index['codes'].get(code)
+        entry = state.index['regions'].get(str(region_id))
+        if entry is None:
+            return None
+        return state, entry[0], entry[1]
+
+    def response(self, located):
+        """
+        Serve one region's bytes without copying them through Python where possible:
+        servers that provide wsgi.file_wrapper (gunicorn) send them with sendfile,
+        bounded by Content-Length. Otherwise the slice is taken from the mmap.
+        """
+        state, offset, length = located
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            f = open(state.data_path, 'rb')
+            f.seek(offset)
+            body = file_wrapper(f, 64 * 1024)
+        else:
+            body = [state.mapped[offset:offset + length]]
+
+        response = Response(body, mimetype='application/json', direct_passthrough=True)
+        response.headers['Content-Length'] = str(length)
+        return response
@@ -0,0 +1,255 @@
+"""
+Import targets: the local SQLite database or the MySQL server used by app.py
+
+Importers always load their rows into the local staging database first (see
+staged_import.py), where the geometry statistics are computed. The backend then
+moves the staged rows into its live regions table:
+
+    SQLiteBackend   swaps them in with staged_import.swap_in()
+    MySQLBackend    bulk-loads them into a temporary table with large multi-row
+                    INSERTs (or LOAD DATA LOCAL INFILE), then merges that table
+                    into regions with one INSERT ... ON DUPLICATE KEY UPDATE,
+                    inside a single transaction with foreign key checks off
+
+The backend is chosen by IMPORT_CONFIG in config.py.
+"""
+import os
+import sqlite3
+import tempfile
+import dataset
+import staged_import
+from config import DB_CONFIG, IMPORT_CONFIG
+from geometry_pack import export_pack
+
+DATABASE = staged_import.DATABASE
+
+# Columns loaded into MySQL; id is the staging row id and only orders the merge
+STAGED_COLUMNS = staged_import.REGION_COLUMNS + staged_import.GEOMETRY_COLUMNS
+
+
+class SQLiteBackend:
+    """Imports into the local SQLite database served by app_sqlite.py"""
+    name = 'sqlite'
+
+    def __init__(self, database=DATABASE):
+        self.database = database
+
+    def connect(self):
+        db = sqlite3.connect(self.database)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def open_staging(self):
+        return staged_import.open_staging(self.database)
+
+    def swap_in(self, staging, replace_type=None):
+        return staged_import.swap_in(staging, self.database, replace_type=replace_type)
+
+
+class MySQLBackend:
+    """
+    Imports into the MySQL database served by app.py.
+
+    Args:
+        config: pymysql connection settings; DB_CONFIG by default. Point host/port
+            at a local throwaway server to try an import without touching production
+        load: 'insert' for multi-row INSERT batches, 'infile' for LOAD DATA LOCAL INFILE
+            (needs local_infile enabled on the server)
+        batch_rows, batch_bytes: limits for one INSERT statement; batch_bytes must stay
+            below the server's max_allowed_packet
+        staging_database: local SQLite file the staging database is created next to
+    """
+    name = 'mysql'
+
+    def __init__(self, config=None, load=None, batch_rows=None, batch_bytes=None, staging_database=DATABASE):
+        self.config = dict(DB_CONFIG if config is None else config)
+        self.load = load or IMPORT_CONFIG['mysql_load']
+        self.batch_rows = batch_rows or IMPORT_CONFIG['batch_rows']
+        self.batch_bytes = batch_bytes or IMPORT_CONFIG['batch_bytes']
+        self.staging_database = staging_database
+        if self.load not in ('insert', 'infile'):
+            raise ValueError(f"Unknown MySQL load method: {self.load}")
+
+    def connect(self):
+        import pymysql
+        config = dict(self.config, cursorclass=pymysql.cursors.DictCursor)
+        if self.load == 'infile':
+            config['local_infile'] = True
+        return pymysql.connect(**config)
+
+    def open_staging(self):
+        return staged_import.open_staging(self.staging_database)
+
+    def swap_in(self, staging, replace_type=None):
+        """
+        Merge the staged rows into the MySQL regions table in one transaction.
+
+        Rows update the live row with the same code in place (keeping its id, so
+        parent_id links survive) or are inserted if the code is new; NULL staged
+        values in KEEP_EXISTING columns keep the live value, as in the SQLite swap.
+
+        Args:
+            staging: connection returned by open_staging(), with rows loaded
+            replace_type: if set, live rows of this region_type that were not staged are removed
+        """
+        dataset.refresh_geometry_columns(staging, table='regions_staging')
+        staging.commit()
+
+        db = self.connect()
+        try:
+            cursor = db.cursor()
+            cursor.execute("SHOW TABLES LIKE 'regions'")
+            if cursor.fetchone() is None:
+                raise RuntimeError("No regions table in the MySQL database; run app.py once to create it")
+            dataset.ensure_schema(db)
+
+            self._create_staging_table(cursor)
+            rows = staging.execute(f'SELECT id, {", ".join(STAGED_COLUMNS)} FROM regions_staging ORDER BY id')
+            if self.load == 'infile':
+                staged = self._load_infile(cursor, rows)
+            else:
+                staged = self._load_inserts(cursor, rows)
+
+            # Outlines change for the owners of the replaced rows and of the rows merged in
+            merged = 'code IN (SELECT code FROM regions_staging)'
+            owners = dataset.region_owners(db, f'{merged} OR region_type = %s', (replace_type,))
+
+            if replace_type:
+                removed = '''region_type = %s
+                    AND (code IS NULL OR code NOT IN (SELECT code FROM regions_staging WHERE code IS NOT NULL))'''
+                # ON DELETE CASCADE also removes their descendants, whose outlines change too
+                owners |= dataset.region_owners(db, f'''id IN (
+                    WITH RECURSIVE removed (id) AS (
+                        SELECT id FROM regions WHERE {removed}
+                        UNION ALL
+                        SELECT regions.id FROM regions JOIN removed ON regions.parent_id = removed.id
+                    )
+                    SELECT id FROM removed
+                )''', (replace_type,))
+                # Still with foreign key checks on, so the cascade runs
+                cursor.execute(f'DELETE FROM regions WHERE {removed}', (replace_type,))
+
+            # MySQL cannot defer constraints, so checks are off for the merge
+            cursor.execute('SET FOREIGN_KEY_CHECKS = 0')
+            # INSERT ... SELECT takes no row alias; the derived table's alias names the new values
+            # (MySQL 8.0.19+, where VALUES() is deprecated)
+            assignments = ', '.join(
+                f'{name} = COALESCE(new.{name}, regions.{name})'
+                if name in staged_import.KEEP_EXISTING else f'{name} = new.{name}'
+                for name in STAGED_COLUMNS
+            )
+            columns = ', '.join(STAGED_COLUMNS)
+            cursor.execute(f'''
+                INSERT INTO regions ({columns})
+                SELECT * FROM (SELECT {columns} FROM regions_staging ORDER BY id) AS new
+                ON DUPLICATE KEY UPDATE {assignments}
+            ''')
+
+            dataset.publish_import(db, owners | dataset.region_owners(db, merged))
+            dataset.stamp_rows(db, f'{merged} OR row_version IS NULL')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            staging.close()
+            if db.open:
+                db.cursor().execute('SET FOREIGN_KEY_CHECKS = 1')
+
+        export_pack(db, dataset.get_version(db, 'geometry_version'))
+        db.close()
+        os.remove(staged_import.staging_path(self.staging_database))
+        print(f"Merged {staged} staged regions into MySQL ({self.load})")
+        return staged
+
+    def _create_staging_table(self, cursor):
+        # Temporary: private to this connection and dropped with it
+        geometry = ''.join(f',\n                {name} {sql_type}' for name, sql_type in dataset.GEOMETRY_COLUMNS.items())
+        cursor.execute('DROP TEMPORARY TABLE IF EXISTS regions_staging')
+        cursor.execute(f'''
+            CREATE TEMPORARY TABLE regions_staging (
+                id INT PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                code VARCHAR(10),
+                parent_id INT,
+                region_type VARCHAR(50),
+                geojson_data LONGTEXT,
+                custom_data TEXT,
+                owner VARCHAR(255){geometry},
+                KEY (code)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        ''')
+
+    def _load_inserts(self, cursor, rows):
+        prefix = f'INSERT INTO regions_staging (id, {", ".join(STAGED_COLUMNS)}) VALUES '
+        return insert_batches(cursor, prefix, rows, self.batch_rows, self.batch_bytes)
+
+    def _load_infile(self, cursor, rows):
+        """Write the rows to a tab-separated file and LOAD DATA LOCAL INFILE it"""
+        loaded = 0
+        handle, path = tempfile.mkstemp(suffix='.tsv')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8', newline='') as f:
+                for row in rows:
+                    f.write('\t'.join(_infile_field(value) for value in tuple(row)) + '\n')
+                    loaded += 1
+            cursor.execute(f'''
+                LOAD DATA LOCAL INFILE %s INTO TABLE regions_staging CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'
+                (id, {", ".join(STAGED_COLUMNS)})
+            ''', (path,))
+        finally:
+            os.remove(path)
+        return loaded
+
+
+def insert_batches(cursor, prefix, rows, batch_rows, batch_bytes):
+    """
+    Send rows to MySQL as multi-row statements of at most batch_rows rows and
+    roughly batch_bytes bytes each; returns the number of rows sent.
+
+    Args:
+        prefix: statement up to and including VALUES, e.g. 'INSERT INTO t (a, b) VALUES '
+        rows: iterable of row tuples (or sqlite3.Row), read lazily
+    """
+    sent = 0
+    batch = []
+    size = 0
+
+    def flush():
+        values = '(' + ', '.join(['%s'] * len(batch[0])) + ')'
+        cursor.execute(prefix + ', '.join([values] * len(batch)), [value for row in batch for value in row])
+
+    for row in rows:
+        row = tuple(row)
+        row_size = sum(len(value) for value in row if isinstance(value, str)) + 16 * len(row)
+        if batch and (len(batch) >= batch_rows or size + row_size > batch_bytes):
+            flush()
+            sent += len(batch)
+            batch, size = [], 0
+        batch.append(row)
+        size += row_size
+    if batch:
+        flush()
+        sent += len(batch)
+    return sent
+
+
+def _infile_field(value):
+    """One LOAD DATA field with MySQL's default escaping"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def get_backend(name=None):
+    """The import backend named by IMPORT_CONFIG['backend'] (or name)"""
+    name = name or IMPORT_CONFIG['backend']
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'mysql':
+        return MySQLBackend()
+    raise ValueError(f"Unknown import backend: {name}")
@@ -2,25 +2,18 @@
 Import higher quality US States GeoJSON data
 This uses a better data source with more accurate boundaries
 """
-import sqlite3
+import argparse
 import json
-import requests
+import download_cache
+import dataset
+import import_backends
 
-DATABASE = 'database/globe.db'
+# SQLite or MySQL, chosen by IMPORT_CONFIG in config.py
+backend = import_backends.get_backend()
 
 def get_db():
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
-
-def clear_existing_states():
-    """Remove old state data"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM regions WHERE region_type = 'state'")
-    db.commit()
-    db.close()
-    print("Cleared old state data")
+    """Connect to the import target database"""
+    return backend.connect()
 
 def import_us_states_high_quality():
     """Import US states from a better quality source"""
@@ -41,25 +34,28 @@ def import_us_states_high_quality():
     cursor = db.cursor()
 
     # Get USA parent ID
-    cursor.execute('SELECT id FROM regions WHERE code = "USA"')
+    ph = dataset.placeholder(db)
+    cursor.execute(f'SELECT id FROM regions WHERE code = {ph}', ('USA',))
     usa = cursor.fetchone()
     parent_id = usa['id'] if usa else None
 
     if not parent_id:
         print("Creating USA parent...")
-        cursor.execute('INSERT INTO regions (name, code, region_type) VALUES (?, ?, ?)',
+        cursor.execute(f'INSERT INTO regions (name, code, region_type) VALUES ({ph}, {ph}, {ph})',
                       ('United States', 'USA', 'country'))
         db.commit()
         parent_id = cursor.lastrowid
+    db.close()
 
     for source in sources:
+        # A fresh staging table per source; old states are only replaced by a successful swap
+        staging = backend.open_staging()
+        cursor = staging.cursor()
         try:
             print(f"\nTrying source: {source['name']}")
             print(f"URL: {source['url']}")
 
-            response = requests.get(source['url'], timeout=30)
-            response.raise_for_status()
-            data = response.json()
+            data = download_cache.fetch_json(source['url'], timeout=30)
 
             imported = 0
             features = data.get('features', [])
@@ -113,7 +109,7 @@ def import_us_states_high_quality():
 
                 try:
                     cursor.execute('''
-                        INSERT OR REPLACE INTO regions
+                        INSERT OR REPLACE INTO regions_staging
                         (name, code, parent_id, region_type, geojson_data)
                         VALUES (?, ?, ?, ?, ?)
                     ''', (name, code, parent_id, 'state', json.dumps(geometry)))
@@ -124,30 +120,33 @@ def import_us_states_high_quality():
                 except Exception as e:
                     print(f"  [ERROR] {name}: {e}")
 
-            db.commit()
+            staging.commit()
 
             if imported > 0:
+                backend.swap_in(staging, replace_type='state')
                 print(f"\n✓ Successfully imported {imported} states from {source['name']}")
-                db.close()
                 return True
+            staging.close()
 
         except Exception as e:
+            staging.close()
             print(f"  Failed: {e}")
             continue
 
-    db.close()
     print("\n✗ Could not import from any source")
     return False
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--offline', action='store_true', help='use only cached downloads and local files')
+    download_cache.offline_mode = parser.parse_args().offline or download_cache.offline_mode
+
     print("="*60)
     print("US States - High Quality Import")
     print("="*60)
 
-    print("\nStep 1: Clearing old state data...")
-    clear_existing_states()
-
-    print("\nStep 2: Importing high-quality state boundaries...")
+    print("\nImporting high-quality state boundaries...")
+    print("(Existing states are replaced only once the import succeeds)")
     if import_us_states_high_quality():
         print("\n" + "="*60)
         print("SUCCESS! Restart your server to see the changes.")
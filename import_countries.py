@@ -2,17 +2,17 @@
 Import world countries into the database
 This imports the same data that the globe.js was loading externally
 """
-import sqlite3
+import argparse
 import json
-import requests
+import download_cache
+import import_backends
 
-DATABASE = 'database/globe.db'
+# SQLite or MySQL, chosen by IMPORT_CONFIG in config.py
+backend = import_backends.get_backend()
 
 def get_db():
-    """Connect to the SQLite database"""
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    """Connect to the import target database"""
+    return backend.connect()
 
 def import_world_countries():
     """
@@ -22,11 +22,12 @@ def import_world_countries():
     url = "https://raw.githubusercontent.com/datasets/geo-countries/master/data/countries.geojson"
 
     print(f"Fetching world countries from: {url}")
-    response = requests.get(url)
-    data = response.json()
+    data = download_cache.fetch_json(url)
 
-    db = get_db()
-    cursor = db.cursor()
+    # Rows are loaded into a staging table and swapped in at the end,
+    # so the live table is never half-imported
+    staging = backend.open_staging()
+    cursor = staging.cursor()
 
     imported = 0
     skipped = 0
@@ -67,7 +68,7 @@ def import_world_countries():
             }
 
             cursor.execute('''
-                INSERT OR REPLACE INTO regions
+                INSERT OR REPLACE INTO regions_staging
                 (name, code, region_type, geojson_data, custom_data)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
@@ -82,14 +83,18 @@ def import_world_countries():
         except Exception as e:
             print(f"  [ERROR] Error importing {name}: {e}")
 
-    db.commit()
-    db.close()
+    staging.commit()
+    backend.swap_in(staging)
 
     print(f"\nSuccessfully imported {imported} countries!")
     print(f"Skipped {skipped} regions (invalid/missing codes)")
     return imported
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--offline', action='store_true', help='use only cached downloads and local files')
+    download_cache.offline_mode = parser.parse_args().offline or download_cache.offline_mode
+
     print("="*60)
     print("World Countries Importer")
     print("="*60)
@@ -1,17 +1,18 @@
 """
 Import GeoJSON regions into the database
 """
-import sqlite3
+import argparse
 import json
-import requests
+import download_cache
+import dataset
+import import_backends
 
-DATABASE = 'database/globe.db'
+# SQLite or MySQL, chosen by IMPORT_CONFIG in config.py
+backend = import_backends.get_backend()
 
 def get_db():
-    """Connect to the SQLite database"""
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    """Connect to the import target database"""
+    return backend.connect()
 
 def import_geojson_from_url(url, region_type='state', parent_code=None):
     """
@@ -23,8 +24,7 @@ def import_geojson_from_url(url, region_type='state', parent_code=None):
         parent_code: Parent country/region code (e.g., 'USA')
     """
     print(f"Fetching GeoJSON from: {url}")
-    response = requests.get(url)
-    data = response.json()
+    data = download_cache.fetch_json(url)
 
     db = get_db()
     cursor = db.cursor()
@@ -32,13 +32,17 @@ def import_geojson_from_url(url, region_type='state', parent_code=None):
     # Get parent_id if parent_code is provided
     parent_id = None
     if parent_code:
-        cursor.execute('SELECT id FROM regions WHERE code = ?', (parent_code,))
+        cursor.execute(f'SELECT id FROM regions WHERE code = {dataset.placeholder(db)}', (parent_code,))
         parent = cursor.fetchone()
         if parent:
             parent_id = parent['id']
             print(f"Found parent region: {parent_code} (ID: {parent_id})")
         else:
             print(f"Warning: Parent region '{parent_code}' not found. Creating regions without parent.")
+    db.close()
+
+    staging = backend.open_staging()
+    cursor = staging.cursor()
 
     imported = 0
     for feature in data['features']:
@@ -67,7 +71,7 @@ def import_geojson_from_url(url, region_type='state', parent_code=None):
 
         try:
             cursor.execute('''
-                INSERT OR REPLACE INTO regions
+                INSERT OR REPLACE INTO regions_staging
                 (name, code, parent_id, region_type, geojson_data)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
@@ -82,8 +86,8 @@ def import_geojson_from_url(url, region_type='state', parent_code=None):
         except Exception as e:
             print(f"  [ERROR] Error importing {name}: {e}")
 
-    db.commit()
-    db.close()
+    staging.commit()
+    backend.swap_in(staging)
 
     print(f"\nSuccessfully imported {imported} regions!")
     return imported
@@ -107,13 +111,17 @@ def import_geojson_from_file(filepath, region_type='state', parent_code=None):
     # Get parent_id if parent_code is provided
     parent_id = None
     if parent_code:
-        cursor.execute('SELECT id FROM regions WHERE code = ?', (parent_code,))
+        cursor.execute(f'SELECT id FROM regions WHERE code = {dataset.placeholder(db)}', (parent_code,))
         parent = cursor.fetchone()
         if parent:
             parent_id = parent['id']
             print(f"Found parent region: {parent_code} (ID: {parent_id})")
         else:
             print(f"Warning: Parent region '{parent_code}' not found. Creating regions without parent.")
+    db.close()
+
+    staging = backend.open_staging()
+    cursor = staging.cursor()
 
     imported = 0
     features = data.get('features', [])
@@ -144,7 +152,7 @@ def import_geojson_from_file(filepath, region_type='state', parent_code=None):
 
         try:
             cursor.execute('''
-                INSERT OR REPLACE INTO regions
+                INSERT OR REPLACE INTO regions_staging
                 (name, code, parent_id, region_type, geojson_data)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
@@ -159,8 +167,8 @@ def import_geojson_from_file(filepath, region_type='state', parent_code=None):
         except Exception as e:
             print(f"  [ERROR] Error importing {name}: {e}")
 
-    db.commit()
-    db.close()
+    staging.commit()
+    backend.swap_in(staging)
 
     print(f"\nSuccessfully imported {imported} regions!")
     return imported
@@ -171,9 +179,11 @@ def create_usa_country():
     cursor = db.cursor()
 
     try:
-        cursor.execute('''
-            INSERT OR IGNORE INTO regions (name, code, region_type)
-            VALUES (?, ?, ?)
+        ph = dataset.placeholder(db)
+        ignore = 'OR IGNORE' if dataset.is_sqlite(db) else 'IGNORE'
+        cursor.execute(f'''
+            INSERT {ignore} INTO regions (name, code, region_type)
+            VALUES ({ph}, {ph}, {ph})
         ''', ('United States', 'USA', 'country'))
         db.commit()
         print("Created USA country entry")
@@ -183,6 +193,10 @@ def create_usa_country():
     db.close()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--offline', action='store_true', help='use only cached downloads and local files')
+    download_cache.offline_mode = parser.parse_args().offline or download_cache.offline_mode
+
     print("="*60)
     print("GeoJSON Region Importer")
     print("="*60)
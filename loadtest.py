@@ -0,0 +1,447 @@
+"""
+Local load test: replay a request mix against the server and report per-route latency
+
+    python loadtest.py [--fixture database/globe.db] [--concurrency 16] [--rate 200] [--duration 30]
+    python loadtest.py --replay traffic.jsonl --baseline loadtest-baseline.json
+    python loadtest.py --save-baseline loadtest-baseline.json
+
+By default a copy of the fixture database is served by serve.py on a free
+localhost port, from a temporary directory, so writes never touch the real
+data. Use --url to target a server that is already running (e.g. the MySQL app).
+
+The request mix is either synthetic (built from the rows in the fixture) or
+replayed from a file: JSON lines of {"method", "path", "body"}, or a server
+access log, from which GET lines are taken.
+
+With --rate, requests are issued on a fixed schedule and latency is measured
+from the time each request was due, so a stalled server shows up in the
+percentiles instead of silently lowering the request rate.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import requests
+import dataset
+from config import GEOMETRY_PACK
+from geometry_pack import export_pack
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATABASE = 'database/globe.db'
+
+# Synthetic mix: share of requests per kind
+SYNTHETIC_WEIGHTS = {
+    'regions': 10,
+    'regions_by_type': 10,
+    'regions_sorted': 5,
+    'regions_custom': 5,
+    'region_by_id': 20,
+    'region_by_code': 10,
+    'region_geometry': 15,
+    'search': 8,
+    'nearest': 8,
+    'geojson': 2,
+    'aggregates': 3,
+    'update': 3,
+    'create': 1,
+}
+
+# Path patterns folded into one route for reporting
+ROUTE_PATTERNS = [
+    (re.compile(r'^/api/region/\d+/geometry$'), '/api/region/<id>/geometry'),
+    (re.compile(r'^/api/region/code/[^/]+/geometry$'), '/api/region/code/<code>/geometry'),
+    (re.compile(r'^/api/region/\d+$'), '/api/region/<id>'),
+    (re.compile(r'^/api/region/code/[^/]+$'), '/api/region/code/<code>'),
+    (re.compile(r'^/api/owners/.+/outline$'), '/api/owners/<owner>/outline'),
+]
+
+ACCESS_LOG_LINE = re.compile(r'"(GET|HEAD) (\S+) HTTP/[\d.]+"')
+
+# Region code in a request body that is replaced by a fresh code each time the
+# request is sent, so a cycled or replayed mix never creates the same code twice
+UNIQUE_CODE = '{unique}'
+
+# Default regression thresholds against a baseline
+LATENCY_TOLERANCE = 0.20
+THROUGHPUT_TOLERANCE = 0.10
+ERROR_RATE_TOLERANCE = 0.01
+
+
+def route_of(method, path):
+    """Route key for a request: path template plus the sorted query parameter names"""
+    parts = urlsplit(path)
+    route = parts.path
+    for pattern, template in ROUTE_PATTERNS:
+        if pattern.match(route):
+            route = template
+            break
+    names = sorted({name for name, _ in parse_qsl(parts.query, keep_blank_values=True)})
+    if names:
+        route += '?' + '&'.join(names)
+    return f'{method} {route}'
+
+
+def synthetic_mix(fixture, count, seed=0):
+    """Build count requests from the rows in the fixture database"""
+    db = sqlite3.connect(fixture)
+    db.row_factory = sqlite3.Row
+    rows = [dict(row) for row in db.execute('''
+        SELECT id, name, code, parent_id, region_type, geojson_data, custom_data, owner, centroid_lon, centroid_lat
+        FROM regions WHERE geojson_data IS NOT NULL
+    ''')]
+    continents = [row[0] for row in db.execute(
+        "SELECT DISTINCT json_extract(custom_data, '$.continent') FROM regions WHERE json_valid(custom_data)"
+    ) if row[0]]
+    db.close()
+    if not rows:
+        raise SystemExit(f"No regions with geometry in {fixture}")
+
+    rng = random.Random(seed)
+    kinds = list(SYNTHETIC_WEIGHTS)
+    weights = [SYNTHETIC_WEIGHTS[kind] for kind in kinds]
+    coded = [row for row in rows if row['code']] or rows
+    mix = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        row = rng.choice(rows)
+        if kind == 'regions':
+            mix.append({'method': 'GET', 'path': '/api/regions'})
+        elif kind == 'regions_by_type':
+            mix.append({'method': 'GET', 'path': f'/api/regions?type={rng.choice(["country", "state"])}'})
+        elif kind == 'regions_sorted':
+            mix.append({'method': 'GET', 'path': '/api/regions?sort=area_km2&order=desc&limit=20'})
+        elif kind == 'regions_custom' and continents:
+            mix.append({'method': 'GET', 'path': f'/api/regions?custom.continent={rng.choice(continents)}'})
+        elif kind == 'region_by_code':
+            mix.append({'method': 'GET', 'path': f'/api/region/code/{rng.choice(coded)["code"]}'})
+        elif kind == 'region_geometry':
+            mix.append({'method': 'GET', 'path': f'/api/region/{row["id"]}/geometry'})
+        elif kind == 'search':
+            mix.append({'method': 'GET', 'path': f'/api/regions/search?q={row["name"][:3]}'})
+        elif kind == 'nearest':
+            lon, lat = rng.uniform(-180, 180), rng.uniform(-90, 90)
+            mix.append({'method': 'GET', 'path': f'/api/regions/nearest?lon={lon:.3f}&lat={lat:.3f}&k=5'})
+        elif kind == 'geojson':
+            mix.append({'method': 'GET', 'path': '/api/regions/geojson'})
+        elif kind == 'aggregates':
+            mix.append({'method': 'GET', 'path': '/api/stats/aggregates?group_by=owner'})
+        elif kind == 'update':
+            body = {name: row[name] for name in
+                    ('name', 'code', 'parent_id', 'region_type', 'geojson_data', 'custom_data')}
+            body['owner'] = f'loadtest-{rng.randrange(4)}'
+            mix.append({'method': 'PUT', 'path': f'/api/region/{row["id"]}', 'body': body})
+        elif kind == 'create':
+            lon, lat = rng.uniform(-170, 169), rng.uniform(-80, 79)
+            ring = [[lon, lat], [lon + 1, lat], [lon + 1, lat + 1], [lon, lat + 1], [lon, lat]]
+            mix.append({'method': 'POST', 'path': '/api/region', 'body': {
+                'name': f'Load Test {seed}-{i}',
+                'code': UNIQUE_CODE,
+                'region_type': 'loadtest',
+                'geojson_data': json.dumps({'type': 'Polygon', 'coordinates': [ring]}),
+            }})
+        else:
+            mix.append({'method': 'GET', 'path': f'/api/region/{row["id"]}'})
+    return mix
+
+
+def load_replay(path):
+    """Read a recorded mix: JSON lines, or GET/HEAD lines from an access log"""
+    mix = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                mix.append({'method': entry.get('method', 'GET').upper(),
+                            'path': entry['path'], 'body': entry.get('body')})
+                continue
+            match = ACCESS_LOG_LINE.search(line)
+            if match:
+                mix.append({'method': match.group(1), 'path': match.group(2)})
+    if not mix:
+        raise SystemExit(f"No requests found in {path}")
+    return mix
+
+
+def unique_code():
+    """'LT' and 40 random bits: 10 characters, within the MySQL code column"""
+    return 'LT' + base64.b32encode(os.urandom(5)).decode('ascii')
+
+
+def request_body(entry):
+    """The body to send for a mix entry, with UNIQUE_CODE filled in"""
+    body = entry.get('body')
+    if isinstance(body, dict) and body.get('code') == UNIQUE_CODE:
+        body = dict(body, code=unique_code())
+    return body
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """A server for a copy of the fixture database, run from a temporary directory"""
+
+    def __init__(self, fixture, server='gunicorn', workers=2, threads=4):
+        self.workdir = tempfile.mkdtemp(prefix='globe-loadtest-')
+        os.makedirs(os.path.join(self.workdir, 'database'))
+        shutil.copyfile(fixture, os.path.join(self.workdir, DATABASE))
+        self.export_geometry_pack()
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+
+        if server == 'gunicorn':
+            command = [sys.executable, os.path.join(HERE, 'serve.py'), '--backend', 'sqlite',
+                       '--bind', f'127.0.0.1:{self.port}', '--workers', str(workers), '--threads', str(threads)]
+        else:
+            command = [sys.executable, '-c',
+                       'import app_sqlite; app_sqlite.init_db(); '
+                       f'app_sqlite.app.run(host="127.0.0.1", port={self.port}, threaded=True)']
+        env = dict(os.environ, PYTHONPATH=HERE + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def export_geometry_pack(self):
+        """Export the pack for the copy, so geometry requests are served from it and not the database"""
+        db = sqlite3.connect(os.path.join(self.workdir, DATABASE))
+        db.row_factory = sqlite3.Row
+        dataset.ensure_schema(db)
+        export_pack(db, dataset.get_version(db, 'geometry_version'), os.path.join(self.workdir, GEOMETRY_PACK))
+        db.close()
+
+    def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if requests.get(self.url + '/api/regions?limit=1', timeout=5).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        self.stop()
+        with open(self.log.name, encoding='utf-8', errors='replace') as f:
+            print(f.read()[-4000:])
+        raise SystemExit("Server did not start")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_load(url, mix, concurrency, rate=None, duration=None, warmup=0.0):
+    """
+    Send the mix (cycled) from concurrency threads for duration seconds, or once
+    through if duration is None. Requests completed during the warm-up are not recorded.
+
+    Returns (samples, elapsed): samples are (route, seconds, ok, bytes received) tuples.
+    """
+    lock = threading.Lock()
+    samples = []
+    position = [0]
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = started + warmup + duration if duration else None
+
+    def next_request():
+        with lock:
+            i = position[0]
+            position[0] += 1
+        if stop_at is None and i >= len(mix):
+            return None, None
+        due = started + i / rate if rate else time.perf_counter()
+        if stop_at is not None and due >= stop_at:
+            return None, None
+        return mix[i % len(mix)], due
+
+    def worker():
+        session = requests.Session()
+        local = []
+        while True:
+            entry, due = next_request()
+            if entry is None:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            size = 0
+            try:
+                response = session.request(entry['method'], url + entry['path'], json=request_body(entry), timeout=60)
+                ok = response.status_code < 400
+                size = len(response.content)  # reads the whole body, so it counts towards the latency
+            except requests.RequestException:
+                ok = False
+            finished = time.perf_counter()
+            if finished >= measure_from:
+                local.append((route_of(entry['method'], entry['path']), finished - due, ok, size))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - measure_from
+
+
+def summarize(samples, elapsed):
+    """Per-route and overall throughput, latency percentiles (ms), error rate and response size"""
+    by_route = {}
+    for route, seconds, ok, size in samples:
+        by_route.setdefault(route, []).append((seconds, ok, size))
+    by_route['ALL'] = [(seconds, ok, size) for _, seconds, ok, size in samples]
+
+    report = {}
+    for route, values in sorted(by_route.items()):
+        if not values:
+            continue
+        latencies = np.array([seconds for seconds, _, _ in values]) * 1000.0
+        errors = sum(1 for _, ok, _ in values if not ok)
+        received = sum(size for _, _, size in values)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report[route] = {
+            'requests': len(values),
+            'errors': errors,
+            'error_rate': round(errors / len(values), 4),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(float(latencies.mean()), 2),
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2),
+            'max_ms': round(float(latencies.max()), 2),
+            'mean_bytes': round(received / len(values)),
+            'received_mb_s': round(received / elapsed / 1e6, 3),
+        }
+    return report
+
+
+def compare(report, baseline, rate=None, latency_tolerance=LATENCY_TOLERANCE,
+            throughput_tolerance=THROUGHPUT_TOLERANCE, error_tolerance=ERROR_RATE_TOLERANCE):
+    """
+    Regressions of report against baseline routes, as human-readable strings.
+    Throughput is only compared when both runs used the same target rate.
+    """
+    same_rate = baseline['settings'].get('rate') == rate
+    regressions = []
+    for route, old in baseline['routes'].items():
+        new = report.get(route)
+        if new is None:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if new[key] > old[key] * (1 + latency_tolerance):
+                regressions.append(f"{route}: {key} {old[key]} -> {new[key]}")
+        if same_rate and new['throughput_rps'] < old['throughput_rps'] * (1 - throughput_tolerance):
+            regressions.append(f"{route}: throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s")
+        if new['error_rate'] > old['error_rate'] + error_tolerance:
+            regressions.append(f"{route}: error rate {old['error_rate']} -> {new['error_rate']}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'route':<55} {'req':>7} {'err%':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, row in report.items():
+        print(f"{route[:55]:<55} {row['requests']:>7} {row['error_rate'] * 100:>6.2f} {row['throughput_rps']:>8.1f} "
+              f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the globe server on localhost')
+    parser.add_argument('--fixture', default=DATABASE, help='SQLite database to serve (a copy is used)')
+    parser.add_argument('--url', help='target an already running server instead of starting one')
+    parser.add_argument('--server', choices=['gunicorn', 'dev'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--replay', help='recorded mix: JSON lines or an access log')
+    parser.add_argument('--requests', type=int, default=5000, help='size of the synthetic mix')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-mix', help='write the request mix as JSON lines, for later --replay')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, help='target requests per second (default: as fast as possible)')
+    parser.add_argument('--duration', type=float, help='seconds to run, cycling the mix (default: one pass)')
+    parser.add_argument('--warmup', type=float, default=0.0, help='seconds of load not recorded')
+    parser.add_argument('--output', help='write the report as JSON')
+    parser.add_argument('--baseline', help='compare against a saved report; exits 1 on regression')
+    parser.add_argument('--save-baseline', help='save this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=LATENCY_TOLERANCE,
+                        help='allowed relative latency increase over the baseline')
+    args = parser.parse_args()
+
+    mix = load_replay(args.replay) if args.replay else synthetic_mix(args.fixture, args.requests, args.seed)
+    if args.save_mix:
+        with open(args.save_mix, 'w', encoding='utf-8') as f:
+            for entry in mix:
+                f.write(json.dumps(entry) + '\n')
+
+    print("=" * 60)
+    print(f"Load test: {len(mix)} requests in the mix, concurrency {args.concurrency}"
+          + (f", {args.rate:g} req/s" if args.rate else ""))
+    print("=" * 60)
+
+    server = None
+    url = args.url
+    if url is None:
+        server = LocalServer(args.fixture, args.server, args.workers, args.threads)
+        print(f"Starting {args.server} server on {server.url} ...")
+        server.wait_ready()
+        url = server.url
+    try:
+        samples, elapsed = run_load(url.rstrip('/'), mix, args.concurrency, args.rate, args.duration, args.warmup)
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = summarize(samples, elapsed)
+    print_report(report)
+    result = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {'concurrency': args.concurrency, 'rate': args.rate, 'duration': args.duration,
+                     'mix': args.replay or f'synthetic:{args.requests}:{args.seed}',
+                     'server': args.url or f'{args.server} x{args.workers}'},
+        'elapsed_seconds': round(elapsed, 3),
+        'routes': report,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.rate, latency_tolerance=args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline}:")
+            for line in regressions:
+                print(f"  [REGRESSION] {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+Cost profile of the regions table: what each row costs to send, decode and draw
+
+    python profile_dataset.py --output profile.json
+    python profile_dataset.py --type state --top 5
+    python profile_dataset.py --backend mysql --summary-only
+    python profile_dataset.py --backend mysql --mysql-host 127.0.0.1 --mysql-port 3307
+
+For every region the report gives its vertex and ring counts, the serialized
+geojson_data size, its gzip size, an estimate of the browser decode time and
+the per-frame line rendering cost, and how much each simplification level in
+SIMPLIFY_TOLERANCES would save. The aggregate part sums these per region_type,
+lists the rows that dominate the payload and flags outliers. The JSON output is
+meant to be kept per dataset build and compared over time.
+
+The costs come from the constants in COST_MODEL, rough figures for a mid-range
+laptop browser. They are for ranking rows and comparing builds, not for
+absolute timings.
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import time
+import zlib
+import numpy as np
+import dataset
+from config import DB_CONFIG
+from geometry import polygons, simplify
+
+DATABASE = 'database/globe.db'
+
+# Douglas-Peucker tolerances in degrees (about 100 m, 1 km and 5 km at the equator)
+SIMPLIFY_TOLERANCES = [0.001, 0.01, 0.05]
+
+COST_MODEL = {
+    'json_parse_ns_per_byte': 4.0,      # JSON.parse of /api/regions
+    'decode_ns_per_vertex': 40.0,       # region-decoder.js: globe positions, ring arrays, bbox
+    'render_ns_per_line_vertex': 2.0,   # one LineSegments vertex per frame
+    'line_vertex_bytes': 28,            # float32 position (12) + RGBA colour (16)
+}
+
+# A row is flagged when log10 of a metric is above Q3 + OUTLIER_IQR * IQR of its
+# region_type and the metric is at least OUTLIER_MIN_RATIO times the type's median,
+# or when the row alone holds more than OUTLIER_SHARE of all bytes
+OUTLIER_IQR = 1.5
+OUTLIER_MIN_RATIO = 2.0
+OUTLIER_SHARE = 0.05
+OUTLIER_METRICS = ['bytes', 'vertices', 'bytes_per_vertex']
+
+COMPRESSION_LEVEL = 6
+FETCH_BATCH_SIZE = 200
+
+
+def connect(backend, sqlite_path=DATABASE, mysql_config=None):
+    """A read-only connection: profiling never writes, not even the journal mode"""
+    if backend == 'sqlite':
+        db = sqlite3.connect(f'file:{sqlite_path}?mode=ro', uri=True)
+        db.row_factory = sqlite3.Row
+        return db
+    import pymysql
+    db = pymysql.connect(**dict(mysql_config or DB_CONFIG, cursorclass=pymysql.cursors.DictCursor))
+    db.cursor().execute('SET SESSION TRANSACTION READ ONLY')
+    return db
+
+
+def compressed_size(data):
+    """gzip body size (deflate stream plus the 18-byte gzip header and trailer)"""
+    return len(zlib.compress(data, COMPRESSION_LEVEL)) - 6 + 18
+
+
+def line_vertices(geometry):
+    """Vertices the globe uploads for a geometry's borders: 2 per ring edge"""
+    return sum(2 * (len(ring) - 1) for rings in polygons(geometry) for ring in rings)
+
+
+def costs(geometry_text):
+    """Size and cost figures for one serialized geometry (or None if it has none)"""
+    if not geometry_text:
+        return None
+    data = geometry_text.encode('utf-8')
+    try:
+        geometry = json.loads(geometry_text)
+    except ValueError:
+        geometry = None
+    parts = polygons(geometry)
+    vertices = sum(len(ring) for rings in parts for ring in rings)
+    lines = line_vertices(geometry)
+    return {
+        'geometry': geometry,
+        'vertices': vertices,
+        'rings': sum(len(rings) for rings in parts),
+        'bytes': len(data),
+        'compressed_bytes': compressed_size(data),
+        'line_vertices': lines,
+        'gpu_bytes': lines * COST_MODEL['line_vertex_bytes'],
+        'decode_ms': round((len(data) * COST_MODEL['json_parse_ns_per_byte']
+                            + vertices * COST_MODEL['decode_ns_per_vertex']) / 1e6, 4),
+        'render_ms': round(lines * COST_MODEL['render_ns_per_line_vertex'] / 1e6, 4),
+    }
+
+
+def simplification_savings(geometry, original):
+    """Vertices and bytes left, and saved, at each tolerance"""
+    levels = {}
+    for tolerance in SIMPLIFY_TOLERANCES:
+        simplified = simplify(geometry, tolerance)
+        text = json.dumps(simplified) if simplified else ''
+        data = text.encode('utf-8')
+        vertices = sum(len(ring) for rings in polygons(simplified) for ring in rings)
+        compressed = compressed_size(data) if data else 0
+        levels[str(tolerance)] = {
+            'vertices': vertices,
+            'bytes': len(data),
+            'compressed_bytes': compressed,
+            'saved_vertices': original['vertices'] - vertices,
+            'saved_bytes': original['bytes'] - len(data),
+            'saved_compressed_bytes': original['compressed_bytes'] - compressed,
+            'vanishes': simplified is None,
+        }
+    return levels
+
+
+def profile_regions(db, region_type=None, batch_size=FETCH_BATCH_SIZE):
+    """Yield one profile dict per region, reading the table in batches"""
+    cursor = db.cursor()
+    sql = 'SELECT id, code, name, region_type, geojson_data FROM regions'
+    params = ()
+    if region_type:
+        sql += ' WHERE region_type = ' + dataset.placeholder(db)
+        params = (region_type,)
+    cursor.execute(sql + ' ORDER BY id', params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            figures = costs(row['geojson_data'])
+            profile = {
+                'id': row['id'],
+                'code': row['code'],
+                'name': row['name'],
+                'region_type': row['region_type'],
+            }
+            if figures is None:
+                profile.update(vertices=0, rings=0, bytes=0, compressed_bytes=0, line_vertices=0,
+                               gpu_bytes=0, decode_ms=0.0, render_ms=0.0, simplification={})
+            else:
+                geometry = figures.pop('geometry')
+                profile.update(figures)
+                profile['simplification'] = simplification_savings(geometry, figures)
+            profile['bytes_per_vertex'] = round(profile['bytes'] / profile['vertices'], 2) if profile['vertices'] else 0.0
+            yield profile
+
+
+def _totals(profiles):
+    keys = ['vertices', 'rings', 'bytes', 'compressed_bytes', 'line_vertices', 'gpu_bytes', 'decode_ms', 'render_ms']
+    totals = {'regions': len(profiles)}
+    totals.update({key: sum(profile[key] for profile in profiles) for key in keys})
+    for key in ('decode_ms', 'render_ms'):
+        totals[key] = round(totals[key], 3)
+    return totals
+
+
+def flag_outliers(profiles, total_bytes):
+    """Add an 'outliers' list of reasons to each profile; returns the flagged profiles"""
+    by_type = {}
+    for profile in profiles:
+        profile['outliers'] = []
+        by_type.setdefault(profile['region_type'], []).append(profile)
+
+    for group in by_type.values():
+        for metric in OUTLIER_METRICS:
+            values = np.array([profile[metric] for profile in group], dtype=np.float64)
+            present = values > 0
+            if present.sum() < 4:
+                continue
+            logs = np.log10(values[present])
+            q1, q3 = np.percentile(logs, [25, 75])
+            limit = q3 + OUTLIER_IQR * (q3 - q1)
+            median = float(np.median(values[present]))
+            for profile, value in zip(group, values):
+                if value > 0 and np.log10(value) > limit and value >= OUTLIER_MIN_RATIO * median:
+                    profile['outliers'].append(f'{metric} {value:,.0f} vs median {median:,.0f} '
+                                               f'for {profile["region_type"]}')
+
+    for profile in profiles:
+        if total_bytes and profile['bytes'] / total_bytes > OUTLIER_SHARE:
+            profile['outliers'].append(f'{round(profile["bytes"] / total_bytes, 4):.1%} of all bytes')
+    return [profile for profile in profiles if profile['outliers']]
+
+
+def profile_dataset(db, region_type=None, top=10):
+    """The full report: per-region profiles plus aggregates"""
+    started = time.perf_counter()
+    profiles = list(profile_regions(db, region_type))
+    totals = _totals(profiles)
+    outliers = flag_outliers(profiles, totals['bytes'])
+
+    by_type = {}
+    for profile in profiles:
+        by_type.setdefault(profile['region_type'], []).append(profile)
+
+    simplification = {}
+    for tolerance in SIMPLIFY_TOLERANCES:
+        level = str(tolerance)
+        rows = [profile['simplification'][level] for profile in profiles if profile['simplification']]
+        vertices = sum(row['vertices'] for row in rows)
+        size = sum(row['bytes'] for row in rows)
+        compressed = sum(row['compressed_bytes'] for row in rows)
+        simplification[level] = {
+            'vertices': vertices,
+            'bytes': size,
+            'compressed_bytes': compressed,
+            'saved_bytes': totals['bytes'] - size,
+            'saved_compressed_bytes': totals['compressed_bytes'] - compressed,
+            'saved_fraction': round(1 - size / totals['bytes'], 4) if totals['bytes'] else 0.0,
+            'regions_vanishing': sum(row['vanishes'] for row in rows),
+        }
+
+    def summary(profile):
+        return {
+            'id': profile['id'],
+            'code': profile['code'],
+            'name': profile['name'],
+            'region_type': profile['region_type'],
+            'bytes': profile['bytes'],
+            'vertices': profile['vertices'],
+            'share_of_bytes': round(profile['bytes'] / totals['bytes'], 4) if totals['bytes'] else 0.0,
+        }
+
+    heaviest = sorted(profiles, key=lambda profile: profile['bytes'], reverse=True)[:top]
+    return {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'region_type': region_type,
+        'cost_model': COST_MODEL,
+        'simplify_tolerances': SIMPLIFY_TOLERANCES,
+        'totals': totals,
+        'by_type': {name: _totals(group) for name, group in sorted(by_type.items(), key=lambda item: str(item[0]))},
+        'simplification': simplification,
+        'top_by_bytes': [summary(profile) for profile in heaviest],
+        'outliers': [dict(summary(profile), reasons=profile['outliers']) for profile in outliers],
+        'regions': profiles,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report what each region costs to send, decode and draw')
+    parser.add_argument('--backend', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--sqlite-path', default=DATABASE)
+    parser.add_argument('--mysql-host', default=DB_CONFIG['host'])
+    parser.add_argument('--mysql-port', type=int, default=DB_CONFIG.get('port', 3306))
+    parser.add_argument('--mysql-user', default=DB_CONFIG['user'])
+    parser.add_argument('--mysql-password', default=DB_CONFIG['password'])
+    parser.add_argument('--mysql-database', default=DB_CONFIG['database'])
+    parser.add_argument('--type', help='only profile regions of this region_type')
+    parser.add_argument('--top', type=int, default=10, help='number of heaviest rows to list')
+    parser.add_argument('--summary-only', action='store_true', help='leave out the per-region profiles')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    args = parser.parse_args()
+
+    mysql_config = dict(DB_CONFIG, host=args.mysql_host, port=args.mysql_port, user=args.mysql_user,
+                        password=args.mysql_password, database=args.mysql_database)
+    db = connect(args.backend, args.sqlite_path, mysql_config)
+    report = profile_dataset(db, args.type, args.top)
+    db.close()
+    if args.summary_only:
+        del report['regions']
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    totals = report['totals']
+    print(f"Profiled {totals['regions']:,} regions: {totals['vertices']:,} vertices, "
+          f"{totals['bytes'] / 1e6:,.2f} MB ({totals['compressed_bytes'] / 1e6:,.2f} MB gzip), "
+          f"~{totals['decode_ms']:,.0f} ms decode, ~{totals['render_ms']:,.2f} ms/frame; "
+          f"{len(report['outliers'])} outliers", file=sys.stderr)
+    for row in report['top_by_bytes'][:5]:
+        print(f"  {row['name']} ({row['code']}): {row['bytes']:,} bytes, {row['vertices']:,} vertices, "
+              f"{row['share_of_bytes']:.1%} of payload", file=sys.stderr)
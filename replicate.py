@@ -0,0 +1,248 @@
+"""
+Copy the regions table between the SQLite and MySQL backends
+
+    python replicate.py sqlite mysql                  full copy of database/globe.db into DB_CONFIG
+    python replicate.py mysql sqlite --incremental    only the rows written since the last copy
+    python replicate.py sqlite mysql --mysql-host 127.0.0.1 --mysql-port 3307
+
+Rows keep their ids, so parent_id links stay valid. The source is read in one
+consistent snapshot and streamed (a server-side cursor on MySQL), and the
+target is written in large batches inside one transaction. Memory use does not
+grow with the table.
+
+--incremental copies the rows whose row_version is newer than the source
+version recorded by the previous copy, and deletes the target rows whose ids
+no longer exist in the source. Without a recorded version it copies everything.
+
+Both databases need a regions table; run app.py / app_sqlite.py once first.
+"""
+import argparse
+import datetime
+import itertools
+import sqlite3
+import time
+import dataset
+import staged_import
+from config import DB_CONFIG, GEOMETRY_PACK, IMPORT_CONFIG
+from geometry_pack import export_pack
+from import_backends import insert_batches
+
+DATABASE = staged_import.DATABASE
+
+# Copied as stored (generated custom_* columns excluded); row_version is re-stamped in the target
+COPIED_COLUMNS = ['id', 'created_at'] + staged_import.REGION_COLUMNS + staged_import.GEOMETRY_COLUMNS
+
+# dataset_meta entry in the target: source version of the last copy, for --incremental
+CHECKPOINT = 'replicated_version'
+
+
+def connect(backend, sqlite_path=DATABASE, mysql_config=None):
+    if backend == 'sqlite':
+        db = sqlite3.connect(sqlite_path)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+    import pymysql
+    return pymysql.connect(**dict(mysql_config or DB_CONFIG, cursorclass=pymysql.cursors.DictCursor))
+
+
+def _require_regions(db):
+    cursor = db.cursor()
+    if dataset.is_sqlite(db):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'regions'")
+    else:
+        cursor.execute("SHOW TABLES LIKE 'regions'")
+    if cursor.fetchone() is None:
+        raise RuntimeError("No regions table; start app.py / app_sqlite.py once to create it")
+    dataset.ensure_schema(db)
+
+
+def _stamp_unversioned(db):
+    """
+    Give rows written without a row_version (direct INSERTs) a new version of
+    their own, so this copy includes them and later incremental copies skip them
+    """
+    cursor = db.cursor()
+    cursor.execute('SELECT COUNT(*) AS n FROM regions WHERE row_version IS NULL')
+    if cursor.fetchone()['n']:
+        dataset.bump_version(db)
+        dataset.stamp_rows(db, 'row_version IS NULL')
+        db.commit()
+
+
+def _stream(db, sql, params, batch_rows):
+    """Yield rows of a query without holding the whole result in memory"""
+    if dataset.is_sqlite(db):
+        cursor = db.cursor()
+    else:
+        import pymysql
+        cursor = db.cursor(pymysql.cursors.SSDictCursor)
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        yield from rows
+    cursor.close()
+
+
+def _values(row):
+    if isinstance(row, sqlite3.Row):
+        return tuple(row)
+    values = []
+    for name in COPIED_COLUMNS:
+        value = row[name]
+        if isinstance(value, datetime.datetime):
+            value = value.strftime('%Y-%m-%d %H:%M:%S')
+        values.append(value)
+    return tuple(values)
+
+
+def _delete_missing(source, target, batch_rows):
+    """Delete target rows whose ids are gone from the source; returns how many were deleted"""
+    source_ids = {row['id'] for row in _stream(source, 'SELECT id FROM regions', (), batch_rows)}
+    cursor = target.cursor()
+    cursor.execute('SELECT id FROM regions')
+    missing = [row['id'] for row in cursor.fetchall() if row['id'] not in source_ids]
+
+    ph = dataset.placeholder(target)
+    for i in range(0, len(missing), batch_rows):
+        batch = missing[i:i + batch_rows]
+        cursor.execute(f'DELETE FROM regions WHERE id IN ({", ".join([ph] * len(batch))})', batch)
+    return len(missing)
+
+
+def _write_rows(target, rows, batch_rows, batch_bytes):
+    """Insert rows by id, replacing any target row with the same id or code"""
+    columns = ', '.join(COPIED_COLUMNS)
+    cursor = target.cursor()
+    if not dataset.is_sqlite(target):
+        return insert_batches(cursor, f'REPLACE INTO regions ({columns}) VALUES ', rows, batch_rows, batch_bytes)
+
+    statement = f'INSERT OR REPLACE INTO regions ({columns}) VALUES ({", ".join(["?"] * len(COPIED_COLUMNS))})'
+    written = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_rows))
+        if not batch:
+            return written
+        cursor.executemany(statement, batch)
+        written += len(batch)
+
+
+def replicate(source, target, incremental=False, batch_rows=None, batch_bytes=None, pack_path=GEOMETRY_PACK):
+    """
+    Copy regions from the source connection to the target connection.
+
+    Args:
+        incremental: copy only rows changed since the last replication into this target
+        pack_path: geometry pack to rewrite for the target afterwards; None skips it
+    Returns a dict with the number of rows copied and deleted, bytes and seconds.
+    """
+    batch_rows = batch_rows or IMPORT_CONFIG['batch_rows']
+    batch_bytes = batch_bytes or IMPORT_CONFIG['batch_bytes']
+    started = time.perf_counter()
+    _require_regions(source)
+    _require_regions(target)
+    _stamp_unversioned(source)
+
+    # One snapshot for the version, the ids and the rows
+    if dataset.is_sqlite(source):
+        source.execute('BEGIN')
+    else:
+        source.cursor().execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+    source_version = dataset.get_version(source)
+    since = dataset.get_version(target, CHECKPOINT) if incremental else 0
+
+    if dataset.is_sqlite(target):
+        target.isolation_level = None
+        target.execute('BEGIN IMMEDIATE')
+        dataset.drop_search_triggers(target)
+    else:
+        target.cursor().execute('SET FOREIGN_KEY_CHECKS = 0')
+
+    ph = dataset.placeholder(target)
+    stats = {'copied': 0, 'deleted': 0, 'bytes': 0}
+    try:
+        cursor = target.cursor()
+        if incremental:
+            stats['deleted'] = _delete_missing(source, target, batch_rows)
+        else:
+            cursor.execute('SELECT COUNT(*) AS n FROM regions')
+            stats['deleted'] = cursor.fetchone()['n']
+            cursor.execute('DELETE FROM regions')
+
+        condition = f'WHERE row_version > {dataset.placeholder(source)}' if since else ''
+        rows = _stream(source, f'SELECT {", ".join(COPIED_COLUMNS)} FROM regions {condition} ORDER BY id',
+                       (since,) if since else (), batch_rows)
+
+        def counted(rows):
+            for row in rows:
+                values = _values(row)
+                stats['bytes'] += sum(len(value) for value in values if isinstance(value, str))
+                yield values
+
+        stats['copied'] = _write_rows(target, counted(rows), batch_rows, batch_bytes)
+
+        if dataset.is_sqlite(target):
+            dataset.create_search_triggers(target)
+        # A copy can change any row, so every cached outline is dropped
+        dataset.publish_import(target)
+        dataset.stamp_rows(target, 'row_version IS NULL')
+        cursor.execute(f'DELETE FROM dataset_meta WHERE name = {ph}', (CHECKPOINT,))
+        cursor.execute(f'INSERT INTO dataset_meta (name, value) VALUES ({ph}, {ph})', (CHECKPOINT, source_version))
+        if dataset.is_sqlite(target):
+            target.execute('COMMIT')
+        else:
+            target.commit()
+    except Exception:
+        if dataset.is_sqlite(target):
+            target.execute('ROLLBACK')
+        else:
+            target.rollback()
+        raise
+    finally:
+        source.rollback()
+        if not dataset.is_sqlite(target):
+            target.cursor().execute('SET FOREIGN_KEY_CHECKS = 1')
+
+    if pack_path:
+        export_pack(target, dataset.get_version(target, 'geometry_version'), pack_path)
+    stats['seconds'] = time.perf_counter() - started
+    stats['source_version'] = source_version
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Copy the regions table between SQLite and MySQL')
+    parser.add_argument('source', choices=['sqlite', 'mysql'])
+    parser.add_argument('target', choices=['sqlite', 'mysql'])
+    parser.add_argument('--incremental', action='store_true', help='copy only rows changed since the last copy')
+    parser.add_argument('--sqlite-path', default=DATABASE)
+    parser.add_argument('--mysql-host', default=DB_CONFIG['host'])
+    parser.add_argument('--mysql-port', type=int, default=DB_CONFIG.get('port', 3306))
+    parser.add_argument('--mysql-user', default=DB_CONFIG['user'])
+    parser.add_argument('--mysql-password', default=DB_CONFIG['password'])
+    parser.add_argument('--mysql-database', default=DB_CONFIG['database'])
+    parser.add_argument('--batch-rows', type=int, default=IMPORT_CONFIG['batch_rows'])
+    parser.add_argument('--batch-bytes', type=int, default=IMPORT_CONFIG['batch_bytes'])
+    parser.add_argument('--pack', default=GEOMETRY_PACK, help='geometry pack to rewrite for the target')
+    parser.add_argument('--no-pack', action='store_true', help='do not rewrite the geometry pack')
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error('source and target must be different backends')
+
+    mysql_config = dict(DB_CONFIG, host=args.mysql_host, port=args.mysql_port, user=args.mysql_user,
+                        password=args.mysql_password, database=args.mysql_database)
+    source = connect(args.source, args.sqlite_path, mysql_config)
+    target = connect(args.target, args.sqlite_path, mysql_config)
+    try:
+        stats = replicate(source, target, incremental=args.incremental, batch_rows=args.batch_rows,
+                          batch_bytes=args.batch_bytes, pack_path=None if args.no_pack else args.pack)
+    finally:
+        source.close()
+        target.close()
+
+    seconds = stats['seconds']
+    print(f"Copied {stats['copied']:,} regions ({stats['bytes'] / 1e6:,.1f} MB) from {args.source} to "
+          f"{args.target} in {seconds:.2f}s ({stats['copied'] / max(seconds, 1e-9):,.0f} rows/s); "
+          f"deleted {stats['deleted']:,}; source version {stats['source_version']}")
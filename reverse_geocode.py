@@ -0,0 +1,224 @@
+"""
+Batch reverse geocoding: tag many lon/lat points with the region that contains each
+
+    python reverse_geocode.py points.csv [--type state] [--output tagged.csv]
+    python reverse_geocode.py points.json --output tagged.jsonl
+
+CSV input needs a longitude and a latitude column (lon/lng/longitude, lat/latitude,
+or --lon-column/--lat-column); the output is the same CSV with region_id,
+region_code and region_name appended. JSON input is an array of [lon, lat] pairs;
+the output has one JSON line per point. Points are read and tagged in blocks, and
+each block is written as soon as it is done.
+
+Where regions overlap (a country and its states), the smallest one wins; use
+--type to tag with one kind of region only.
+"""
+import argparse
+import csv
+import itertools
+import json
+import sqlite3
+import sys
+import numpy as np
+from dataset import placeholder
+from spatial_index import RegionGrid
+
+DATABASE = 'database/globe.db'
+
+# Points tagged per block
+LOCATE_BLOCK_SIZE = 50000
+
+LON_COLUMNS = ('lon', 'lng', 'long', 'longitude', 'x')
+LAT_COLUMNS = ('lat', 'latitude', 'y')
+RESULT_COLUMNS = ['region_id', 'region_code', 'region_name']
+
+
+def load_grid(db, region_type=None):
+    """Build a RegionGrid over every region (of one type) that has geometry stats"""
+    cursor = db.cursor()
+    query = '''
+        SELECT id, name, code, region_type, area_km2, bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat
+        FROM regions WHERE bbox_min_lon IS NOT NULL
+    '''
+    params = []
+    if region_type:
+        query += f' AND region_type = {placeholder(db)}'
+        params.append(region_type)
+    cursor.execute(query, params)
+    return RegionGrid([dict(row) for row in cursor.fetchall()])
+
+
+def geometry_loader(db, batch_size=500):
+    """Return a load_geometries callable for RegionGrid.locate that reads from db"""
+    def load(region_ids):
+        geometries = {}
+        cursor = db.cursor()
+        ph = placeholder(db)
+        for i in range(0, len(region_ids), batch_size):
+            batch = region_ids[i:i + batch_size]
+            cursor.execute(
+                f'SELECT id, geojson_data FROM regions WHERE id IN ({", ".join([ph] * len(batch))})', batch
+            )
+            for row in cursor.fetchall():
+                geometries[row['id']] = json.loads(row['geojson_data']) if row['geojson_data'] else None
+        return geometries
+    return load
+
+
+def locate(grid, lons, lats, load_geometries, attributes=None, region_type=None):
+    """
+    The containing region dict (or None) for each point.
+
+    Args:
+        attributes: optional {id: region dict} with current id, code, name and region_type,
+            used instead of the grid's own copies (which date from when it was built)
+        region_type: only consider regions of this type
+    """
+    def current(region):
+        return attributes.get(region['id'], region) if attributes is not None else region
+
+    include = None
+    if region_type:
+        include = np.array([current(region)['region_type'] == region_type for region in grid.regions], dtype=bool)
+    found = grid.locate(lons, lats, load_geometries, include)
+    return [current(grid.regions[i]) if i >= 0 else None for i in found]
+
+
+def _coordinate(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def find_column(header, names, explicit=None):
+    """Index of the coordinate column in a CSV header"""
+    lowered = [name.strip().lower() for name in header]
+    for name in ([explicit.lower()] if explicit else names):
+        if name in lowered:
+            return lowered.index(name)
+    raise ValueError(f"CSV header has no {' / '.join([explicit] if explicit else names)} column")
+
+
+def tag_csv(lines, grid, load_geometries, lon_column=None, lat_column=None, block_size=LOCATE_BLOCK_SIZE,
+            counts=None, attributes=None, region_type=None):
+    """
+    Yield the tagged CSV text block by block.
+
+    Args:
+        lines: iterable of CSV text lines, starting with the header
+        counts: optional dict whose 'points' and 'matched' entries are incremented
+        attributes, region_type: as for locate()
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    lon_index = find_column(header, LON_COLUMNS, lon_column)
+    lat_index = find_column(header, LAT_COLUMNS, lat_column)
+
+    out = _LineBuffer()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(header + RESULT_COLUMNS)
+    yield out.take()
+
+    while True:
+        rows = list(itertools.islice(reader, block_size))
+        if not rows:
+            break
+        lons = np.array([_coordinate(row[lon_index]) if len(row) > lon_index else np.nan for row in rows])
+        lats = np.array([_coordinate(row[lat_index]) if len(row) > lat_index else np.nan for row in rows])
+        regions = locate(grid, lons, lats, load_geometries, attributes, region_type)
+        for row, region in zip(rows, regions):
+            writer.writerow(row + ([region['id'], region['code'], region['name']] if region else ['', '', '']))
+        if counts is not None:
+            counts['points'] = counts.get('points', 0) + len(rows)
+            counts['matched'] = counts.get('matched', 0) + sum(region is not None for region in regions)
+        yield out.take()
+
+
+def tag_points(points, grid, load_geometries, block_size=LOCATE_BLOCK_SIZE, attributes=None, region_type=None):
+    """
+    For an (N, 2) array of lon/lat pairs, yield one list of regions (or None) per block of points.
+    attributes and region_type are as for locate().
+    """
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        yield locate(grid, block[:, 0], block[:, 1], load_geometries, attributes, region_type)
+
+
+def parse_points(points):
+    """Validate a JSON list of [lon, lat] pairs as an (N, 2) array; raises ValueError"""
+    try:
+        array = np.asarray(points, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError('points must be a list of [lon, lat] pairs')
+    if array.size == 0:
+        return array.reshape(0, 2)
+    if array.ndim != 2 or array.shape[1] != 2:
+        raise ValueError('points must be a list of [lon, lat] pairs')
+    return array
+
+
+def region_summary(region):
+    if region is None:
+        return None
+    return {'id': region['id'], 'code': region['code'], 'name': region['name'], 'region_type': region['region_type']}
+
+
+class _LineBuffer:
+    """File-like sink for csv.writer whose contents are taken out after each block"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def take(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+
+def get_db():
+    db = sqlite3.connect(DATABASE)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tag lon/lat points with the region containing each')
+    parser.add_argument('input', help='CSV file with lon/lat columns, or a JSON array of [lon, lat] pairs')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    parser.add_argument('--type', help='only consider regions of this region_type')
+    parser.add_argument('--lon-column')
+    parser.add_argument('--lat-column')
+    args = parser.parse_args()
+
+    db = get_db()
+    grid = load_grid(db, args.type)
+    load_geometries = geometry_loader(db)
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+
+    counts = {'points': 0, 'matched': 0}
+    with open(args.input, encoding='utf-8', newline='') as f:
+        if args.input.lower().endswith('.json'):
+            index = 0
+            for regions in tag_points(parse_points(json.load(f)), grid, load_geometries):
+                out.write(''.join(
+                    json.dumps({'index': index + i, 'region': region_summary(region)}) + '\n'
+                    for i, region in enumerate(regions)
+                ))
+                index += len(regions)
+                counts['points'] += len(regions)
+                counts['matched'] += sum(region is not None for region in regions)
+        else:
+            for text in tag_csv(f, grid, load_geometries, args.lon_column, args.lat_column, counts=counts):
+                out.write(text)
+
+    if out is not sys.stdout:
+        out.close()
+    db.close()
+    print(f"Tagged {counts['points']:,} points against {len(grid):,} regions, "
+          f"{counts['matched']:,} inside a region", file=sys.stderr)
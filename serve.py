@@ -0,0 +1,88 @@
+"""
+Production server: a pool of gunicorn worker processes in front of the Flask app
+
+    python serve.py [--backend sqlite|mysql] [--workers N] [--bind HOST:PORT]
+
+The app is loaded once in the master process: init_db runs there (never in the
+workers), then the warm-up requests from SERVER_CONFIG build the in-process
+indexes (the nearest ball tree, region attributes, the geometry pack index).
+Workers are forked afterwards and share those pages copy-on-write. Responses
+themselves are not cached, so warming a list endpoint would achieve nothing.
+
+Reloads:
+    kill -HUP <master pid>    replace workers one generation at a time (same code)
+    kill -USR2 <master pid>   start a new master with new code, then QUIT the old one
+"""
+import argparse
+import gc
+import importlib
+import time
+from gunicorn.app.base import BaseApplication
+from config import SERVER_CONFIG
+
+BACKEND_MODULES = {
+    'sqlite': 'app_sqlite',
+    'mysql': 'app',
+}
+
+
+def load_app(backend):
+    """Import the backend app, initialise the schema once and warm its caches"""
+    module = importlib.import_module(BACKEND_MODULES[backend])
+    module.init_db()
+    warm_up(module.app, SERVER_CONFIG['warm_up_paths'])
+    return module.app
+
+
+def warm_up(app, paths):
+    """Replay warm-up requests in-process so their indexes are built before traffic"""
+    client = app.test_client()
+    for path in paths:
+        start = time.perf_counter()
+        response = client.get(path)
+        print(f"  [WARM] {path} -> {response.status_code} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # Keep the warmed objects out of the garbage collector so forked workers
+    # do not touch (and copy) their pages
+    gc.collect()
+    gc.freeze()
+
+
+class GlobeServer(BaseApplication):
+    def __init__(self, backend, options):
+        self.backend = backend
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return load_app(self.backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the globe server with multiple worker processes')
+    parser.add_argument('--backend', choices=BACKEND_MODULES, default=SERVER_CONFIG['backend'])
+    parser.add_argument('--bind', default=SERVER_CONFIG['bind'])
+    parser.add_argument('--workers', type=int, default=SERVER_CONFIG['workers'])
+    parser.add_argument('--threads', type=int, default=SERVER_CONFIG['threads'])
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"Interactive Globe Server ({args.backend}, {args.workers} workers x {args.threads} threads)")
+    print("=" * 60)
+
+    GlobeServer(args.backend, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'timeout': SERVER_CONFIG['timeout'],
+        'graceful_timeout': SERVER_CONFIG['graceful_timeout'],
+        'preload_app': True,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Single-flight request coalescing
+
+Concurrent calls with the same key wait for one in-flight computation and share
+its result instead of each running the query and serialization themselves.
+Threads in one process coalesce in memory; with a lock directory configured,
+worker processes also coalesce through file locks (POSIX only). A process that
+finds the lock taken leaves a marker file before it waits, and the leader only
+writes its result to disk when it finds one, so an uncontended call costs one
+lock and no copy of the body. Expired files are pruned by a background thread.
+"""
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process coalescing only
+    fcntl = None
+
+# Result and marker files older than this are pruned. Lock files are only removed
+# once they are much older, so a process that has just opened one is never left
+# locking an unlinked file.
+RESULT_TTL_SECONDS = 60
+LOCK_TTL_SECONDS = 3600
+PRUNE_INTERVAL_SECONDS = 60
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Args:
+        lock_dir: directory for cross-process lock and result files; None keeps
+            coalescing within the current process
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pruner = None
+        self._calls = {}
+        self._stats = {'executed': 0, 'coalesced': 0, 'coalesced_cross_process': 0, 'in_flight': 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pid=os.getpid(), cross_process=bool(self.lock_dir))
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._stats[name] += delta
+
+    def do(self, key, compute):
+        """
+        Return compute() for key, sharing one execution between concurrent callers.
+        compute must return bytes when cross-process coalescing is enabled.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['in_flight'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self.lock_dir:
+                self._ensure_pruner()
+                call.result = self._do_across_processes(key, compute)
+            else:
+                call.result = compute()
+                self._count('executed')
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self._stats['in_flight'] -= 1
+            call.event.set()
+
+    def _do_across_processes(self, key, compute):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.lock_dir, name + '.lock')
+        result_path = os.path.join(self.lock_dir, name + '.result')
+        waiting_path = os.path.join(self.lock_dir, name + '.waiting')
+        started = time.time_ns()
+
+        with open(lock_path, 'a+b') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is computing it: ask for its result, then wait
+                open(waiting_path, 'ab').close()
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process finished the same computation while we waited for the lock
+                try:
+                    if os.stat(result_path).st_mtime_ns >= started:
+                        with open(result_path, 'rb') as f:
+                            result = f.read()
+                        self._count('coalesced_cross_process')
+                        return result
+                except FileNotFoundError:
+                    pass
+
+                result = compute()
+                self._count('executed')
+                # Only share the result if some process is waiting for it
+                if os.path.exists(waiting_path):
+                    with open(result_path + '.tmp', 'wb') as f:
+                        f.write(result)
+                    os.replace(result_path + '.tmp', result_path)
+                    os.remove(waiting_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return result
+
+    def _ensure_pruner(self):
+        # Started lazily so the thread lives in the worker process, never before a fork
+        if self._pruner is None or not self._pruner.is_alive():
+            with self._lock:
+                if self._pruner is None or not self._pruner.is_alive():
+                    self._pruner = threading.Thread(target=self._prune, name='singleflight-pruner', daemon=True)
+                    self._pruner.start()
+
+    def _prune(self):
+        while True:
+            time.sleep(PRUNE_INTERVAL_SECONDS)
+            self._remove_expired()
+
+    def _remove_expired(self):
+        now = time.time()
+        for entry in os.scandir(self.lock_dir):
+            ttl = LOCK_TTL_SECONDS if entry.name.endswith('.lock') else RESULT_TTL_SECONDS
+            try:
+                if entry.stat().st_mtime < now - ttl:
+                    os.remove(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,196 @@
+"""
+Spatial indexes over regions
+
+RegionBallTree: ball tree over unit vectors for k-nearest region queries on the
+sphere. Each item is a spherical cap (centroid + radius), so the same tree
+answers both "nearest centroid" and "nearest boundary" queries.
+
+RegionGrid: uniform lon/lat grid over region bounding boxes, for finding the
+region that contains each of many points at once.
+"""
+import heapq
+import itertools
+import numpy as np
+from geometry import EARTH_RADIUS_KM, to_unit_vectors, angle_between, polygons, contains_points
+
+LEAF_SIZE = 16
+GRID_CELL_DEGREES = 2.0
+
+
+class _Node:
+    __slots__ = ('center', 'radius', 'items', 'children')
+
+    def __init__(self, center, radius, items=None, children=None):
+        self.center = center
+        self.radius = radius
+        self.items = items
+        self.children = children
+
+
+class RegionBallTree:
+    """
+    Args:
+        regions: list of dicts with at least id, centroid_lon, centroid_lat, radius_km
+    """
+
+    def __init__(self, regions):
+        self.regions = list(regions)
+        self.geometry_cache = {}
+        if self.regions:
+            lon = np.array([r['centroid_lon'] for r in self.regions], dtype=np.float64)
+            lat = np.array([r['centroid_lat'] for r in self.regions], dtype=np.float64)
+            self.vectors = to_unit_vectors(lon, lat)
+            self.radii = np.array([r['radius_km'] or 0.0 for r in self.regions]) / EARTH_RADIUS_KM
+            self.root = self._build(np.arange(len(self.regions)))
+        else:
+            self.vectors = np.zeros((0, 3))
+            self.radii = np.zeros(0)
+            self.root = None
+
+    def __len__(self):
+        return len(self.regions)
+
+    def _build(self, idx):
+        points = self.vectors[idx]
+        center = points.sum(axis=0)
+        norm = np.linalg.norm(center)
+        center = center / norm if norm > 1e-12 else points[0]
+        radius = float((angle_between(points, center) + self.radii[idx]).max())
+
+        if len(idx) <= LEAF_SIZE:
+            return _Node(center, radius, items=idx)
+
+        # Split along the axis with the largest spread
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        order = np.argsort(points[:, axis], kind='stable')
+        half = len(idx) // 2
+        return _Node(center, radius, children=(
+            self._build(idx[order[:half]]),
+            self._build(idx[order[half:]])
+        ))
+
+    def nearest(self, lon, lat, k=5, mode='centroid', predicate=None, boundary_distance=None):
+        """
+        Return up to k (region, distance_km) pairs ordered by distance.
+
+        Args:
+            mode: 'centroid' or 'boundary'
+            predicate: optional filter called with each region dict
+            boundary_distance: callable(region, lon, lat) -> km, required for mode='boundary'
+        """
+        if self.root is None or k <= 0:
+            return []
+
+        q = to_unit_vectors(lon, lat)
+        counter = itertools.count()
+        heap = [(0.0, next(counter), 'node', self.root)]
+        results = []
+
+        # Best-first search: entries pop in order of their lower bound, so an
+        # 'exact' entry that reaches the top is guaranteed to be the next nearest.
+        while heap and len(results) < k:
+            bound, _, kind, payload = heapq.heappop(heap)
+
+            if kind == 'exact':
+                results.append((self.regions[payload], bound * EARTH_RADIUS_KM))
+            elif kind == 'item':
+                region = self.regions[payload]
+                km = boundary_distance(region, lon, lat)
+                if km is not None:
+                    heapq.heappush(heap, (km / EARTH_RADIUS_KM, next(counter), 'exact', payload))
+            elif payload.items is not None:
+                angles = angle_between(self.vectors[payload.items], q)
+                for i, angle in zip(payload.items, angles):
+                    if predicate and not predicate(self.regions[i]):
+                        continue
+                    if mode == 'boundary':
+                        heapq.heappush(heap, (max(0.0, angle - self.radii[i]), next(counter), 'item', i))
+                    else:
+                        heapq.heappush(heap, (float(angle), next(counter), 'exact', i))
+            else:
+                for child in payload.children:
+                    angle = float(angle_between(child.center, q))
+                    heapq.heappush(heap, (max(0.0, angle - child.radius), next(counter), 'node', child))
+
+        return results
+
+
+class RegionGrid:
+    """
+    Args:
+        regions: list of dicts with at least id, area_km2 and the bbox_* columns
+        cell_degrees: size of a grid cell
+    """
+
+    def __init__(self, regions, cell_degrees=GRID_CELL_DEGREES):
+        # Smallest first, so the most specific region (a state before its country) claims each point
+        self.regions = sorted(
+            (r for r in regions if r['bbox_min_lon'] is not None),
+            key=lambda r: r['area_km2'] or 0.0
+        )
+        self.polygon_cache = {}
+        self.cell = cell_degrees
+        self.columns = int(np.ceil(360.0 / cell_degrees))
+        self.rows = int(np.ceil(180.0 / cell_degrees))
+        self.bboxes = np.array([
+            [r['bbox_min_lon'], r['bbox_min_lat'], r['bbox_max_lon'], r['bbox_max_lat']]
+            for r in self.regions
+        ], dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def _column(self, lon):
+        return np.clip(((np.asarray(lon) + 180.0) // self.cell).astype(np.int64), 0, self.columns - 1)
+
+    def _row(self, lat):
+        return np.clip(((np.asarray(lat) + 90.0) // self.cell).astype(np.int64), 0, self.rows - 1)
+
+    def locate(self, lons, lats, load_geometries, include=None):
+        """
+        Return, for each point, the index into self.regions of the smallest region
+        containing it, or -1.
+
+        Args:
+            load_geometries: callable(list of region ids) -> {id: GeoJSON geometry},
+                called once per locate() for regions not yet in polygon_cache
+            include: optional boolean array over self.regions; regions where it is
+                False are skipped
+        """
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        result = np.full(len(lons), -1, dtype=np.int64)
+        if len(lons) == 0 or not self.regions:
+            return result
+
+        # Sort points by cell; each grid row a bbox spans is then one contiguous slice
+        valid = np.isfinite(lons) & np.isfinite(lats)
+        cells = np.where(valid, self._row(np.where(valid, lats, 0)) * self.columns
+                         + self._column(np.where(valid, lons, 0)), self.rows * self.columns)
+        order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[order]
+
+        pending = []
+        for i, (min_lon, min_lat, max_lon, max_lat) in enumerate(self.bboxes):
+            if include is not None and not include[i]:
+                continue
+            rows = np.arange(self._row(min_lat), self._row(max_lat) + 1) * self.columns
+            lo = np.searchsorted(sorted_cells, rows + self._column(min_lon))
+            hi = np.searchsorted(sorted_cells, rows + self._column(max_lon) + 1)
+            if (hi > lo).any():
+                pending.append((i, lo, hi))
+
+        missing = [self.regions[i]['id'] for i, _, _ in pending if self.regions[i]['id'] not in self.polygon_cache]
+        if missing:
+            loaded = load_geometries(missing)
+            for region_id in missing:
+                self.polygon_cache[region_id] = polygons(loaded.get(region_id))
+
+        for i, lo, hi in pending:
+            candidates = order[np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])]
+            candidates = candidates[result[candidates] < 0]
+            if len(candidates) == 0:
+                continue
+            inside = contains_points(self.polygon_cache[self.regions[i]['id']], lons[candidates], lats[candidates])
+            result[candidates[inside]] = i
+        return result
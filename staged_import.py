@@ -0,0 +1,200 @@
+"""
+Staged imports: load into a shadow table, then swap it in atomically
+
+Importers write their rows into regions_staging, which lives in a separate
+database file so loading never holds the live database's write lock. Derived
+columns are computed there. swap_in() then replaces the live rows inside one
+short transaction. With the live database in WAL mode, readers keep seeing the
+old rows until the commit and the new rows right after it, with no gap. The
+rows that were replaced are kept in regions_previous, so rollback() can restore
+them.
+
+    python staged_import.py --rollback     undo the most recent swap
+"""
+import argparse
+import os
+import sqlite3
+import dataset
+from geometry_pack import export_pack
+
+DATABASE = 'database/globe.db'
+
+# Columns copied between the live, staging and previous tables (generated custom_* columns excluded)
+REGION_COLUMNS = ['name', 'code', 'parent_id', 'region_type', 'geojson_data', 'custom_data', 'owner']
+GEOMETRY_COLUMNS = list(dataset.GEOMETRY_COLUMNS)
+
+# Staged values that are NULL keep the live value: importers do not carry game state
+KEEP_EXISTING = {'parent_id', 'custom_data', 'owner'}
+
+
+def staging_path(database):
+    root, ext = os.path.splitext(database)
+    return f'{root}-staging{ext}'
+
+
+def open_staging(database=DATABASE):
+    """Create an empty staging database next to the live one and return a connection to it"""
+    path = staging_path(database)
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    staging = sqlite3.connect(path)
+    staging.row_factory = sqlite3.Row
+    geometry = ''.join(f',\n            {name} {sql_type}' for name, sql_type in dataset.GEOMETRY_COLUMNS.items())
+    staging.execute(f'''
+        CREATE TABLE regions_staging (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            code TEXT UNIQUE,
+            parent_id INTEGER,
+            region_type TEXT DEFAULT 'country',
+            geojson_data TEXT,
+            custom_data TEXT,
+            owner TEXT{geometry}
+        )
+    ''')
+    staging.commit()
+    return staging
+
+
+def _connect_live(database):
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    dataset.ensure_schema(db)
+    db.isolation_level = None  # the swap manages its own transaction
+    return db
+
+
+def swap_in(staging, database=DATABASE, replace_type=None):
+    """
+    Replace live rows with the staged ones in a single transaction.
+
+    Staged rows update the live row with the same code in place (keeping its id,
+    so parent_id links survive) or are inserted if the code is new.
+
+    Args:
+        staging: connection returned by open_staging(), with rows loaded
+        replace_type: if set, live rows of this region_type that were not staged are removed
+    """
+    # Expensive work happens before the swap, outside any lock on the live database
+    dataset.refresh_geometry_columns(staging, table='regions_staging')
+    staging.commit()
+    staged = staging.execute('SELECT COUNT(*) FROM regions_staging').fetchone()[0]
+    staging.close()
+
+    db = _connect_live(database)
+    db.execute('ATTACH DATABASE ? AS staging', (staging_path(database),))
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        _keep_previous(db, replace_type)
+
+        copied = REGION_COLUMNS + GEOMETRY_COLUMNS
+        max_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM regions').fetchone()[0]
+        if replace_type:
+            db.execute('''
+                DELETE FROM regions WHERE region_type = ?
+                AND (code IS NULL OR code NOT IN (SELECT code FROM staging.regions_staging WHERE code IS NOT NULL))
+            ''', (replace_type,))
+
+        assignments = ', '.join(
+            f'{name} = COALESCE(s.{name}, regions.{name})' if name in KEEP_EXISTING else f'{name} = s.{name}'
+            for name in copied
+        )
+        db.execute(f'''
+            UPDATE regions SET {assignments}
+            FROM staging.regions_staging AS s WHERE s.code = regions.code
+        ''')
+        db.execute(f'''
+            INSERT INTO regions ({", ".join(copied)})
+            SELECT {", ".join(copied)} FROM staging.regions_staging
+            WHERE code IS NULL OR code NOT IN (SELECT code FROM regions WHERE code IS NOT NULL)
+            ORDER BY id
+        ''')
+        db.execute('''
+            INSERT INTO import_swapped_ids (id)
+            SELECT id FROM regions
+            WHERE id > ? OR code IN (SELECT code FROM staging.regions_staging WHERE code IS NOT NULL)
+        ''', (max_id,))
+
+        # Outlines change for the owners of the replaced rows and of the rows swapped in
+        owners = (dataset.region_owners(db, '1', table='regions_previous')
+                  | dataset.region_owners(db, 'id IN (SELECT id FROM import_swapped_ids)'))
+        dataset.publish_import(db, owners)
+        dataset.stamp_rows(db, 'id IN (SELECT id FROM import_swapped_ids)')
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    finally:
+        db.execute('DETACH DATABASE staging')
+
+    export_pack(db, dataset.get_version(db, 'geometry_version'))
+    db.close()
+    os.remove(staging_path(database))
+    print(f"Swapped in {staged} staged regions")
+    return staged
+
+
+def _keep_previous(db, replace_type):
+    """Copy every live row the swap is about to touch into regions_previous"""
+    copied = ['id', 'created_at'] + REGION_COLUMNS + GEOMETRY_COLUMNS
+    db.execute('DROP TABLE IF EXISTS regions_previous')
+    db.execute(f'CREATE TABLE regions_previous AS SELECT {", ".join(copied)} FROM regions WHERE 0')
+    db.execute('CREATE TABLE IF NOT EXISTS import_swapped_ids (id INTEGER PRIMARY KEY)')
+    db.execute('DELETE FROM import_swapped_ids')
+    db.execute(f'''
+        INSERT INTO regions_previous
+        SELECT {", ".join(copied)} FROM regions
+        WHERE code IN (SELECT code FROM staging.regions_staging WHERE code IS NOT NULL)
+        OR region_type = ?
+    ''', (replace_type,))
+
+
+def rollback(database=DATABASE):
+    """Restore the rows replaced by the most recent swap_in(); returns False if there is nothing to undo"""
+    db = _connect_live(database)
+    exists = db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'regions_previous'"
+    ).fetchone()
+    if not exists:
+        db.close()
+        return False
+
+    copied = ['id', 'created_at'] + REGION_COLUMNS + GEOMETRY_COLUMNS
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        owners = (dataset.region_owners(db, 'id IN (SELECT id FROM import_swapped_ids)')
+                  | dataset.region_owners(db, '1', table='regions_previous'))
+        db.execute('DELETE FROM regions WHERE id IN (SELECT id FROM import_swapped_ids)')
+        db.execute(f'''
+            INSERT INTO regions ({", ".join(copied)})
+            SELECT {", ".join(copied)} FROM regions_previous
+        ''')
+        dataset.publish_import(db, owners)
+        dataset.stamp_rows(db, 'id IN (SELECT id FROM regions_previous)')
+        db.execute('DROP TABLE regions_previous')
+        db.execute('DELETE FROM import_swapped_ids')
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+    export_pack(db, dataset.get_version(db, 'geometry_version'))
+    db.close()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Staged import maintenance')
+    parser.add_argument('--rollback', action='store_true', help='undo the most recent staged import')
+    args = parser.parse_args()
+
+    if args.rollback:
+        if rollback():
+            print("Restored the regions replaced by the last import")
+        else:
+            print("Nothing to roll back")
+    else:
+        parser.print_help()
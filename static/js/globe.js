@@ -1,5 +1,11 @@
 import * as THREE from 'three';
 import { OrbitControls } from 'three/addons/controls/OrbitControls.js';
+import { decodeRegions, DEFAULT_COLOR } from './region-decoder.js';
+
+const BORDER_OPACITY = 0.6;
+const HIGHLIGHT_COLOR = new THREE.Color(0xff4444);
+const PICK_CELL_DEGREES = 5;
+const KM2_PER_SQUARE_DEGREE = 12364; // at the equator; only used to order regions without an area
 
 class InteractiveGlobe {
     constructor() {
@@ -10,14 +16,18 @@ class InteractiveGlobe {
         this.globe = null;
         this.atmosphere = null;
         this.countries = new Map();
-        this.regionBorders = [];
+        this.regionBorders = []; // One LineSegments per border layer
+        this.borderLayers = new Map(); // layer name -> { lines, regions }
+        this.pickGrid = []; // lat/lon cell -> regions whose bbox overlaps it, smallest first
+        this.ringCoords = null; // Float64Array of lon/lat pairs of every ring, for picking
+        this.ringOffsets = null; // ring i spans points ringOffsets[i] .. ringOffsets[i + 1]
         this.selectedRegion = null;
         this.hoveredRegion = null;
         this.selectedMesh = null; // Filled mesh for selected region
 
-        // Raycaster for click detection
+        // Raycaster for click detection: only the globe sphere is hit-tested, the
+        // region under the cursor is then found through the picking grid
         this.raycaster = new THREE.Raycaster();
-        this.raycaster.params.Line.threshold = 0.5; // Increase threshold for easier line selection
         this.mouse = new THREE.Vector2();
 
         this.init();
@@ -244,30 +254,13 @@ class InteractiveGlobe {
 
     async loadRegions() {
         try {
-            // Try to load from database first
-            const response = await fetch('/api/regions');
-            const regions = await response.json();
+            // Try to load from database first; fetched and decoded in a worker
+            const { payload, source } = await this.loadRegionPayload();
 
-            if (regions.length > 0) {
+            if (payload.regions.length > 0) {
                 // Load regions from database
-                console.log(`Loading ${regions.length} regions from database`);
-                regions.forEach((region) => {
-                    const geojson = JSON.parse(region.geojson_data);
-                    const customData = region.custom_data ? JSON.parse(region.custom_data) : {};
-
-                    this.countries.set(region.code, {
-                        id: region.id,
-                        name: region.name,
-                        code: region.code,
-                        type: region.region_type,
-                        owner: region.owner,
-                        geometry: geojson,
-                        color: customData.color || '#66ffcc'
-                    });
-
-                    // Only create borders (lines), not filled meshes
-                    this.createRegionBorders(geojson, region);
-                });
+                console.log(`Loading ${payload.regions.length} regions from database (${source})`);
+                this.applyRegionPayload(payload);
             } else {
                 // Fallback to external GeoJSON
                 console.log('No regions in database, loading from external source...');
@@ -283,132 +276,229 @@ class InteractiveGlobe {
         }
     }
 
+    loadRegionPayload() {
+        // The worker answers from its IndexedDB cache when the geometry version is
+        // unchanged; either way the typed arrays are transferred, not copied
+        return new Promise((resolve, reject) => {
+            const worker = new Worker(new URL('./region-worker.js', import.meta.url), { type: 'module' });
+            worker.onmessage = (event) => {
+                worker.terminate();
+                if (event.data.error) {
+                    reject(new Error(event.data.error));
+                } else {
+                    resolve(event.data);
+                }
+            };
+            worker.onerror = (event) => {
+                worker.terminate();
+                reject(new Error(event.message || 'Region worker failed'));
+            };
+            worker.postMessage({
+                regionsUrl: '/api/regions',
+                attributesUrl: '/api/regions/attributes',
+                versionUrl: '/api/dataset/version'
+            });
+        });
+    }
+
     async loadExternalCountries() {
         try {
             const response = await fetch('https://raw.githubusercontent.com/datasets/geo-countries/master/data/countries.geojson');
             const data = await response.json();
 
-            data.features.forEach((feature) => {
-                const countryName = feature.properties.ADMIN || feature.properties.name;
-                const countryCode = feature.properties.ISO_A3 || feature.properties.iso_a3;
-
-                const regionData = {
-                    name: countryName,
-                    code: countryCode,
-                    type: 'country',
-                    geometry: feature.geometry,
-                    color: '#66ffcc'
-                };
-
-                this.countries.set(countryCode, regionData);
-                this.createRegionBorders(feature.geometry, regionData);
-            });
+            const rows = data.features.map((feature) => ({
+                name: feature.properties.ADMIN || feature.properties.name,
+                code: feature.properties.ISO_A3 || feature.properties.iso_a3,
+                region_type: 'country',
+                geometry: feature.geometry
+            }));
+            this.applyRegionPayload(decodeRegions(rows));
         } catch (error) {
             console.error('Error loading external countries:', error);
         }
     }
 
-    createRegionBorders(geometry, regionData) {
-        if (!geometry || !geometry.coordinates) return;
-
-        const processPolygon = (coords) => {
-            if (!coords || coords.length < 2) return;
+    applyRegionPayload(payload) {
+        payload.regions.forEach(region => this.countries.set(region.code, region));
+        this.ringCoords = payload.coords;
+        this.ringOffsets = payload.ringOffsets;
+        this.buildBorderLayers(payload);
+        this.buildPickingIndex();
+    }
 
-            const points3D = [];
-            coords.forEach(coord => {
-                const [lon, lat] = coord;
-                const phi = (90 - lat) * (Math.PI / 180);
-                const theta = (lon + 180) * (Math.PI / 180);
+    buildBorderLayers(payload) {
+        // One LineSegments per layer: one draw call each. Each region owns a
+        // contiguous vertex range, which is what highlighting repaints.
+        Object.entries(payload.layers).forEach(([name, positions]) => {
+            this.removeBorderLayer(name);
 
-                const x = -100 * Math.sin(phi) * Math.cos(theta);
-                const y = 100 * Math.cos(phi);
-                const z = 100 * Math.sin(phi) * Math.sin(theta);
+            const geometry = new THREE.BufferGeometry();
+            geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
+            geometry.setAttribute('color', new THREE.BufferAttribute(new Float32Array(positions.length / 3 * 4), 4));
+            geometry.computeBoundingSphere();
 
-                points3D.push(new THREE.Vector3(x, y, z));
+            const material = new THREE.LineBasicMaterial({
+                vertexColors: true,
+                transparent: true
             });
 
-            if (points3D.length < 2) return;
-
-            // Create border line only
-            const lineGeometry = new THREE.BufferGeometry().setFromPoints(points3D);
-            const color = new THREE.Color(regionData.color || '#66ffcc');
+            const lines = new THREE.LineSegments(geometry, material);
+            const regions = payload.regions
+                .filter(region => region.layer === name)
+                .map(region => ({
+                    layer: name,
+                    start: region.start,
+                    count: region.count,
+                    userData: {
+                        regionId: region.id,
+                        regionCode: region.code,
+                        regionName: region.name,
+                        regionType: region.type,
+                        regionOwner: region.owner,
+                        regionVertexCount: region.vertexCount,
+                        regionAreaKm2: region.areaKm2,
+                        regionColor: region.color,
+                        originalColor: new THREE.Color(region.color || DEFAULT_COLOR),
+                        bbox: region.bbox,
+                        ringStart: region.ringStart,
+                        ringEnd: region.ringEnd
+                    }
+                }));
+
+            this.borderLayers.set(name, { lines, regions });
+            regions.forEach(region => this.paintRegion(region, region.userData.originalColor, BORDER_OPACITY, false));
+
+            this.globe.add(lines);
+            this.regionBorders.push(lines);
+        });
+    }
 
-            const lineMaterial = new THREE.LineBasicMaterial({
-                color: color,
-                transparent: true,
-                opacity: 0.6,
-                linewidth: 1
-            });
+    removeBorderLayer(name) {
+        const layer = this.borderLayers.get(name);
+        if (!layer) return;
 
-            const line = new THREE.Line(lineGeometry, lineMaterial);
-            line.userData = {
-                regionId: regionData.id,
-                regionCode: regionData.code,
-                regionName: regionData.name,
-                regionType: regionData.type,
-                regionOwner: regionData.owner,
-                regionColor: regionData.color,
-                originalColor: color.getHex(),
-                isRegionBorder: true,
-                geometry: geometry // Store for later if we want to fill it
-            };
+        this.globe.remove(layer.lines);
+        layer.lines.geometry.dispose();
+        layer.lines.material.dispose();
+        this.regionBorders = this.regionBorders.filter(lines => lines !== layer.lines);
+        this.borderLayers.delete(name);
+    }
 
-            this.globe.add(line);
-            this.regionBorders.push(line);
-        };
+    paintRegion(region, color, opacity, upload = true) {
+        const attribute = this.borderLayers.get(region.layer).lines.geometry.attributes.color;
+        const array = attribute.array;
+        for (let i = region.start * 4, end = (region.start + region.count) * 4; i < end; i += 4) {
+            array[i] = color.r;
+            array[i + 1] = color.g;
+            array[i + 2] = color.b;
+            array[i + 3] = opacity;
+        }
 
-        if (geometry.type === 'Polygon') {
-            geometry.coordinates.forEach(ring => {
-                processPolygon(ring);
-            });
-        } else if (geometry.type === 'MultiPolygon') {
-            geometry.coordinates.forEach(polygon => {
-                polygon.forEach(ring => {
-                    processPolygon(ring);
-                });
-            });
+        if (upload) {
+            // Only this region's slice of the colour buffer is re-uploaded
+            attribute.addUpdateRange(region.start * 4, region.count * 4);
         }
+        attribute.needsUpdate = true;
     }
 
-    onMouseClick(event) {
+    buildPickingIndex() {
+        // Lat/lon grid over the region bounding boxes. Each cell lists the regions
+        // whose bbox overlaps it, smallest area first, so a state wins over its country.
+        const columns = 360 / PICK_CELL_DEGREES;
+        const rows = 180 / PICK_CELL_DEGREES;
+        this.pickGrid = Array.from({ length: columns * rows }, () => []);
+
+        const regions = [];
+        this.borderLayers.forEach(layer => regions.push(...layer.regions));
+        const size = ({ userData }) => userData.regionAreaKm2 != null
+            ? userData.regionAreaKm2
+            : (userData.bbox[2] - userData.bbox[0]) * (userData.bbox[3] - userData.bbox[1]) * KM2_PER_SQUARE_DEGREE;
+        regions.sort((a, b) => size(a) - size(b));
+
+        regions.forEach(region => {
+            const [minLon, minLat, maxLon, maxLat] = region.userData.bbox;
+            const [column0, row0] = this.pickCell(minLon, minLat);
+            const [column1, row1] = this.pickCell(maxLon, maxLat);
+            for (let row = row0; row <= row1; row++) {
+                for (let column = column0; column <= column1; column++) {
+                    this.pickGrid[row * columns + column].push(region);
+                }
+            }
+        });
+    }
+
+    pickCell(lon, lat) {
+        const columns = 360 / PICK_CELL_DEGREES;
+        const rows = 180 / PICK_CELL_DEGREES;
+        return [
+            Math.min(columns - 1, Math.max(0, Math.floor((lon + 180) / PICK_CELL_DEGREES))),
+            Math.min(rows - 1, Math.max(0, Math.floor((lat + 90) / PICK_CELL_DEGREES)))
+        ];
+    }
+
+    pickRegion(event) {
         // Calculate mouse position in normalized device coordinates
         this.mouse.x = (event.clientX / window.innerWidth) * 2 - 1;
         this.mouse.y = -(event.clientY / window.innerHeight) * 2 + 1;
-
-        // Update the raycaster
         this.raycaster.setFromCamera(this.mouse, this.camera);
 
-        // Check for intersections with region borders
-        const intersects = this.raycaster.intersectObjects(this.regionBorders);
+        // One ray-sphere test, then lon/lat of the hit point
+        const hit = this.raycaster.intersectObject(this.globe, false)[0];
+        if (!hit) return null;
+        const local = this.globe.worldToLocal(hit.point.clone());
+        const lat = 90 - Math.acos(Math.max(-1, Math.min(1, local.y / local.length()))) * (180 / Math.PI);
+        let lon = Math.atan2(local.z, -local.x) * (180 / Math.PI) - 180;
+        if (lon < -180) lon += 360;
+
+        // Only the regions listed in the cell under the cursor are tested
+        const [column, row] = this.pickCell(lon, lat);
+        const candidates = this.pickGrid[row * (360 / PICK_CELL_DEGREES) + column] || [];
+        return candidates.find(region => {
+            const [minLon, minLat, maxLon, maxLat] = region.userData.bbox;
+            return lon >= minLon && lon <= maxLon && lat >= minLat && lat <= maxLat
+                && this.regionContains(region, lon, lat);
+        }) || null;
+    }
 
-        if (intersects.length > 0) {
-            const clickedLine = intersects[0].object;
-            this.selectRegion(clickedLine);
-        } else {
-            this.deselectRegion();
+    regionContains(region, lon, lat) {
+        // Even-odd ray crossing test over all rings (holes cancel out)
+        const coords = this.ringCoords;
+        let inside = false;
+        for (let ring = region.userData.ringStart; ring < region.userData.ringEnd; ring++) {
+            const first = this.ringOffsets[ring];
+            const end = this.ringOffsets[ring + 1];
+            for (let i = first, j = end - 1; i < end; j = i++) {
+                const xi = coords[i * 2], yi = coords[i * 2 + 1];
+                const xj = coords[j * 2], yj = coords[j * 2 + 1];
+                if ((yi > lat) !== (yj > lat) && lon < xi + ((lat - yi) * (xj - xi)) / (yj - yi)) {
+                    inside = !inside;
+                }
+            }
         }
+        return inside;
     }
 
-    onMouseMove(event) {
-        // Only change cursor, don't do expensive raycasting on every move
-        this.mouse.x = (event.clientX / window.innerWidth) * 2 - 1;
-        this.mouse.y = -(event.clientY / window.innerHeight) * 2 + 1;
-
-        this.raycaster.setFromCamera(this.mouse, this.camera);
-        const intersects = this.raycaster.intersectObjects(this.regionBorders);
+    onMouseClick(event) {
+        const region = this.pickRegion(event);
 
-        if (intersects.length > 0) {
-            this.renderer.domElement.style.cursor = 'pointer';
+        if (region) {
+            this.selectRegion(region);
         } else {
-            this.renderer.domElement.style.cursor = 'grab';
+            this.deselectRegion();
         }
     }
 
-    selectRegion(borderLine) {
+    onMouseMove(event) {
+        this.hoveredRegion = this.pickRegion(event);
+        this.renderer.domElement.style.cursor = this.hoveredRegion ? 'pointer' : 'grab';
+    }
+
+    selectRegion(region) {
+        if (!region) return;
+
         // Deselect previous region
-        if (this.selectedRegion && this.selectedRegion !== borderLine) {
-            this.selectedRegion.material.color.setHex(this.selectedRegion.userData.originalColor);
-            this.selectedRegion.material.opacity = 0.6;
+        if (this.selectedRegion && this.selectedRegion !== region) {
+            this.paintRegion(this.selectedRegion, this.selectedRegion.userData.originalColor, BORDER_OPACITY);
         }
 
         // Remove previous filled mesh if exists
@@ -418,18 +508,16 @@ class InteractiveGlobe {
         }
 
         // Select new region
-        this.selectedRegion = borderLine;
-        this.selectedRegion.material.color.setHex(0xff4444); // Red highlight
-        this.selectedRegion.material.opacity = 1.0;
+        this.selectedRegion = region;
+        this.paintRegion(region, HIGHLIGHT_COLOR, 1.0); // Red highlight
 
         // Show info panel
-        this.showInfoPanel(borderLine.userData);
+        this.showInfoPanel(region.userData);
     }
 
     deselectRegion() {
         if (this.selectedRegion) {
-            this.selectedRegion.material.color.setHex(this.selectedRegion.userData.originalColor);
-            this.selectedRegion.material.opacity = 0.6;
+            this.paintRegion(this.selectedRegion, this.selectedRegion.userData.originalColor, BORDER_OPACITY);
             this.selectedRegion = null;
         }
 
@@ -447,7 +535,10 @@ class InteractiveGlobe {
         document.getElementById('region-code').textContent = regionData.regionCode || '-';
         document.getElementById('region-type').textContent = regionData.regionType || 'country';
         document.getElementById('region-owner').textContent = regionData.regionOwner || 'None';
-        document.getElementById('region-points').textContent = '-';
+        document.getElementById('region-points').textContent =
+            regionData.regionVertexCount != null ? regionData.regionVertexCount.toLocaleString() : '-';
+        document.getElementById('region-area').textContent =
+            regionData.regionAreaKm2 != null ? `${Math.round(regionData.regionAreaKm2).toLocaleString()} km²` : '-';
 
         panel.classList.remove('hidden');
     }
@@ -0,0 +1,173 @@
+// Turns region rows into flat typed arrays the globe can use directly.
+// Shared by region-worker.js (database regions, off the main thread) and
+// globe.js (external fallback data).
+
+export const GLOBE_RADIUS = 100;
+export const DEFAULT_COLOR = '#66ffcc';
+
+export function writeGlobePosition(lon, lat, target, offset) {
+    const phi = (90 - lat) * (Math.PI / 180);
+    const theta = (lon + 180) * (Math.PI / 180);
+
+    target[offset] = -GLOBE_RADIUS * Math.sin(phi) * Math.cos(theta);
+    target[offset + 1] = GLOBE_RADIUS * Math.cos(phi);
+    target[offset + 2] = GLOBE_RADIUS * Math.sin(phi) * Math.sin(theta);
+    return offset + 3;
+}
+
+function geometryRings(geometry) {
+    if (!geometry || !geometry.coordinates) return [];
+
+    let rings = [];
+    if (geometry.type === 'Polygon') {
+        rings = geometry.coordinates;
+    } else if (geometry.type === 'MultiPolygon') {
+        geometry.coordinates.forEach(polygon => rings.push(...polygon));
+    }
+    return rings.filter(ring => ring && ring.length >= 2);
+}
+
+function regionColor(row) {
+    let customData = {};
+    try {
+        customData = row.custom_data ? JSON.parse(row.custom_data) : {};
+    } catch (error) {
+        customData = {};
+    }
+    return customData.color || DEFAULT_COLOR;
+}
+
+/**
+ * Decode rows shaped like /api/regions results (geojson_data as text, or
+ * geometry as an object) into:
+ *   regions     - plain metadata per region, including its border layer, vertex
+ *                 range in that layer and ring range in coords
+ *   layers      - layer name (region type) -> Float32Array of line segment positions
+ *   coords      - Float64Array of lon/lat pairs of every ring, for picking
+ *   ringOffsets - Uint32Array, ring i spans points ringOffsets[i] .. ringOffsets[i + 1]
+ * Every array is a separate buffer, so the payload can be transferred between threads.
+ */
+export function decodeRegions(rows) {
+    const decoded = [];
+    const layerVertices = new Map();
+    let ringTotal = 0;
+    let pointTotal = 0;
+
+    rows.forEach(row => {
+        const geometry = row.geometry || (row.geojson_data ? JSON.parse(row.geojson_data) : null);
+        const rings = geometryRings(geometry);
+        if (rings.length === 0) return;
+
+        const layer = row.region_type || 'country';
+        // Every ring becomes a run of line segments: 2 vertices per edge
+        const count = rings.reduce((sum, ring) => sum + 2 * (ring.length - 1), 0);
+        const start = layerVertices.get(layer) || 0;
+        layerVertices.set(layer, start + count);
+
+        decoded.push({
+            rings,
+            region: {
+                id: row.id,
+                name: row.name,
+                code: row.code,
+                type: row.region_type,
+                owner: row.owner,
+                vertexCount: row.vertex_count,
+                areaKm2: row.area_km2,
+                bbox: row.bbox_min_lon != null
+                    ? [row.bbox_min_lon, row.bbox_min_lat, row.bbox_max_lon, row.bbox_max_lat]
+                    : null,
+                color: regionColor(row),
+                layer,
+                start,
+                count,
+                ringStart: ringTotal,
+                ringEnd: ringTotal + rings.length
+            }
+        });
+        ringTotal += rings.length;
+        pointTotal += rings.reduce((sum, ring) => sum + ring.length, 0);
+    });
+
+    const layers = {};
+    const layerOffsets = {};
+    layerVertices.forEach((count, name) => {
+        layers[name] = new Float32Array(count * 3);
+        layerOffsets[name] = 0;
+    });
+    const coords = new Float64Array(pointTotal * 2);
+    const ringOffsets = new Uint32Array(ringTotal + 1);
+
+    let ring = 0;
+    let point = 0;
+    decoded.forEach(({ rings, region }) => {
+        const positions = layers[region.layer];
+        let offset = layerOffsets[region.layer];
+        let bbox = region.bbox ? null : [Infinity, Infinity, -Infinity, -Infinity];
+
+        rings.forEach(coordinates => {
+            ringOffsets[ring++] = point;
+            for (let i = 0; i < coordinates.length; i++) {
+                const [lon, lat] = coordinates[i];
+                coords[point * 2] = lon;
+                coords[point * 2 + 1] = lat;
+                point++;
+
+                if (i > 0) {
+                    const [lon0, lat0] = coordinates[i - 1];
+                    offset = writeGlobePosition(lon0, lat0, positions, offset);
+                    offset = writeGlobePosition(lon, lat, positions, offset);
+                }
+                // Bounding box from the rings when the server did not send one
+                if (bbox) {
+                    bbox[0] = Math.min(bbox[0], lon);
+                    bbox[1] = Math.min(bbox[1], lat);
+                    bbox[2] = Math.max(bbox[2], lon);
+                    bbox[3] = Math.max(bbox[3], lat);
+                }
+            }
+        });
+        layerOffsets[region.layer] = offset;
+        if (bbox) region.bbox = bbox;
+    });
+    ringOffsets[ring] = point;
+
+    return {
+        regions: decoded.map(({ region }) => region),
+        layers,
+        coords,
+        ringOffsets
+    };
+}
+
+export function payloadTransferables(payload) {
+    return [
+        ...Object.values(payload.layers).map(array => array.buffer),
+        payload.coords.buffer,
+        payload.ringOffsets.buffer
+    ];
+}
+
+/**
+ * Update a decoded payload in place with rows from /api/regions/attributes.
+ * Returns false if the payload cannot take them: a region is missing or its
+ * type (and so its border layer) changed, which needs a full decode.
+ */
+export function applyAttributes(payload, rows) {
+    const byId = new Map(rows.map(row => [row.id, row]));
+    const fits = payload.regions.every(region => {
+        const row = byId.get(region.id);
+        return row !== undefined && (row.region_type || 'country') === region.layer;
+    });
+    if (!fits) return false;
+
+    payload.regions.forEach(region => {
+        const row = byId.get(region.id);
+        region.name = row.name;
+        region.code = row.code;
+        region.type = row.region_type;
+        region.owner = row.owner;
+        region.color = regionColor(row);
+    });
+    return true;
+}
@@ -0,0 +1,83 @@
+// Fetches and decodes the region dataset off the main thread. The decoded arrays
+// are kept in IndexedDB, keyed by the server's geometry version, so a repeat visit
+// with unchanged geometry skips both the geometry download and the decode; only
+// the small attribute list (/api/regions/attributes) is fetched to catch renames,
+// owner and color changes.
+import { applyAttributes, decodeRegions, payloadTransferables } from './region-decoder.js';
+
+const DB_NAME = 'globe-cache';
+const STORE = 'datasets';
+const CACHE_KEY = 'regions';
+
+function openCache() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(DB_NAME, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore(STORE);
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function cacheRequest(db, mode, action) {
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(STORE, mode);
+        const request = action(transaction.objectStore(STORE));
+        transaction.oncomplete = () => resolve(request.result);
+        transaction.onerror = () => reject(transaction.error);
+        transaction.onabort = () => reject(transaction.error);
+    });
+}
+
+async function fetchJson(url) {
+    try {
+        const response = await fetch(url, { cache: 'no-store' });
+        return response.ok ? await response.json() : null;
+    } catch (error) {
+        return null;
+    }
+}
+
+async function load({ regionsUrl, attributesUrl, versionUrl }) {
+    const [versions, cache] = await Promise.all([
+        fetchJson(versionUrl),
+        openCache().catch(() => null)
+    ]);
+    const version = versions ? versions.geometry_version : null;
+
+    // Without a version (server unreachable) any cached copy is better than nothing
+    const cached = cache
+        ? await cacheRequest(cache, 'readonly', store => store.get(CACHE_KEY)).catch(() => null)
+        : null;
+    if (cached && cached.geometryVersion !== undefined
+            && (version === null || cached.geometryVersion === version)) {
+        if (version === null) {
+            return { payload: cached.payload, version: cached.geometryVersion, source: 'cache' };
+        }
+        const attributes = await fetchJson(attributesUrl);
+        if (attributes === null || applyAttributes(cached.payload, attributes)) {
+            return { payload: cached.payload, version, source: 'cache' };
+        }
+    }
+
+    const response = await fetch(regionsUrl);
+    if (!response.ok) {
+        throw new Error(`${regionsUrl} returned HTTP ${response.status}`);
+    }
+    const payload = decodeRegions(await response.json());
+
+    // Stored before the buffers are transferred (and detached) below
+    if (cache && version !== null) {
+        await cacheRequest(cache, 'readwrite', store => store.put({ geometryVersion: version, payload }, CACHE_KEY))
+            .catch(error => console.warn('Could not cache regions:', error));
+    }
+    return { payload, version, source: 'network' };
+}
+
+self.onmessage = async (event) => {
+    try {
+        const result = await load(event.data);
+        self.postMessage(result, payloadTransferables(result.payload));
+    } catch (error) {
+        self.postMessage({ error: error && error.message ? error.message : String(error) });
+    }
+};
@@ -0,0 +1,161 @@
+"""
+Group-commit write queue
+
+Request threads hand their writes to one writer thread, which runs whatever has
+queued up (bounded by a batch size and a latency window) in a single transaction
+and commits once. Each request still blocks until the commit containing its
+write has returned, so an acknowledged write is durable; what is saved is one
+write-lock acquisition and one fsync per batch instead of per write.
+"""
+import queue
+import threading
+import time
+from dataset import is_sqlite
+
+
+class _Write:
+    __slots__ = ('write', 'done', 'result', 'error', 'state')
+
+    def __init__(self, write):
+        self.write = write
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.state = 'queued'  # then 'running', or 'cancelled' if submit() gave up first
+
+
+class GroupCommitWriter:
+    """
+    Args:
+        connect: callable returning a new database connection (used by the writer thread only)
+        max_batch: most writes committed together
+        max_delay_ms: longest time the first write of a batch waits for company
+        submit_timeout_s: longest time submit() waits for its write to be picked up
+    """
+
+    def __init__(self, connect, max_batch=64, max_delay_ms=5, submit_timeout_s=30):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self.submit_timeout = submit_timeout_s
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'writes': 0, 'failed': 0, 'batches': 0, 'largest_batch': 0}
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['average_batch'] = round(stats['writes'] / stats['batches'], 2) if stats['batches'] else 0
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def submit(self, write):
+        """Run write(db) in the next batch and return its result once the batch is committed"""
+        self._ensure_started()
+        item = _Write(write)
+        self._queue.put(item)
+        if not item.done.wait(self.submit_timeout):
+            # Withdraw the write if no batch has taken it yet; one already running is waited for
+            with self._claim_lock:
+                cancelled = item.state == 'queued'
+                if cancelled:
+                    item.state = 'cancelled'
+            if cancelled:
+                raise TimeoutError(f"Write not started within {self.submit_timeout}s")
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _ensure_started(self):
+        # Started lazily so the thread is created in the worker process, never before a fork;
+        # restarted if it ever died
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        db = None
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            with self._claim_lock:
+                batch = [item for item in batch if item.state == 'queued']
+                for item in batch:
+                    item.state = 'running'
+            if not batch:
+                continue
+
+            if db is None:
+                try:
+                    db = self.connect()
+                    if is_sqlite(db):
+                        db.isolation_level = None  # transactions are managed explicitly below
+                except Exception as e:
+                    # Fail this batch and try to connect again for the next one
+                    db = None
+                    for item in batch:
+                        item.error = e
+                    self._finish(batch)
+                    continue
+            if not self._commit(db, batch):
+                # Start over with a fresh connection after a failed commit
+                try:
+                    db.close()
+                except Exception:
+                    pass
+                db = None
+
+    def _commit(self, db, batch):
+        cursor = db.cursor()
+        committed = False
+        try:
+            cursor.execute('BEGIN IMMEDIATE' if is_sqlite(db) else 'BEGIN')
+            for i, item in enumerate(batch):
+                # A savepoint per write, so one bad write does not fail the whole batch
+                cursor.execute(f'SAVEPOINT write_{i}')
+                try:
+                    item.result = item.write(db)
+                    cursor.execute(f'RELEASE SAVEPOINT write_{i}')
+                except Exception as e:
+                    item.error = e
+                    cursor.execute(f'ROLLBACK TO SAVEPOINT write_{i}')
+                    cursor.execute(f'RELEASE SAVEPOINT write_{i}')
+            db.commit()
+            committed = True
+        except Exception as e:
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            for item in batch:
+                if item.error is None:
+                    item.result, item.error = None, e
+        finally:
+            self._finish(batch)
+        return committed
+
+    def _finish(self, batch):
+        """Count the batch and wake its submitters"""
+        failed = sum(1 for item in batch if item.error is not None)
+        with self._stats_lock:
+            self._stats['writes'] += len(batch)
+            self._stats['failed'] += failed
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        for item in batch:
+            item.done.set()